@@ -360,7 +360,7 @@ def update_svm_graph(
         print('asdfasdfasdf')
     
     if tab == 'kernel':
-        kernel_fig = show_3d_kernel(dc.spiral, True)
+        kernel_fig = show_3d_kernel(dc.kernels(), True)
         kernel_fig.update_layout(paper_bgcolor='rgba(0,0,0,0)',
                                 plot_bgcolor='rgba(0,0,0,0)',
                                 scene_bgcolor='rgba(0,0,0,0)',
@@ -0,0 +1,206 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+from skimage import io, draw
+
+from donut_corners import DonutCorners, kernel_bank
+
+# kernel sizes, from the small transform kernel up to the building kernels
+KERNELS = {
+    'small': {'angle_count': 12, 'beam_width': 2, 'beam_length': 5, 'beam_start': 1,
+              'eval_method': {'elimination_width': 2, 'max_n': 2, 'elim_double_ends': True}},
+    'medium': {'angle_count': 24, 'beam_width': 2, 'beam_length': 10, 'beam_start': 3,
+               'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}},
+    'large': {'angle_count': 48, 'beam_width': 3, 'beam_length': 20, 'beam_start': 5,
+              'eval_method': {'elimination_width': 4, 'max_n': 3, 'elim_double_ends': True}},
+}
+
+# (name, source, shape), source is a bldg image crop or a synthetic shape image
+IMAGES = [
+    ('bldg-1_100x150', ('bldg', 1, (slice(0, 100), slice(700, 850))), None),
+    ('bldg-1_200x300', ('bldg', 1, (slice(0, 200), slice(650, 950))), None),
+    ('bldg-2_400x400', ('bldg', 2, (slice(1000, 1400), slice(1000, 1400))), None),
+    ('shapes_128', ('shapes', 0, None), (128, 128)),
+    ('shapes_256', ('shapes', 1, None), (256, 256)),
+]
+QUICK_IMAGES = ('bldg-1_100x150', 'shapes_128')
+QUICK_KERNELS = ('small', 'medium')
+
+TRANSFORM_SHAPE = (32, 32)
+TRANSFORM_COUNT = 32
+POINT_COUNT = 200
+
+
+def shapes_image(shape, seed=0, count=8):
+    # rectangles, triangles and disks of random gray levels on a dark background
+    rng = np.random.RandomState(seed)
+    img = np.full(shape, 20, dtype=np.uint8)
+    h, w = shape
+    for i in range(count):
+        y, x = rng.randint(0, h), rng.randint(0, w)
+        size = rng.randint(min(h, w) // 10, min(h, w) // 3)
+        kind = i % 3
+        if kind == 0:
+            rr, cc = draw.rectangle((y, x), extent=(size, size * 2 // 3), shape=shape)
+        elif kind == 1:
+            rr, cc = draw.polygon([y, y + size, y + size // 2], [x, x + size // 3, x + size], shape=shape)
+        else:
+            rr, cc = draw.ellipse(y, x, size // 2, size // 2, shape=shape)
+        img[rr, cc] = rng.randint(60, 255)
+    return img
+
+
+def load_image(source, shape):
+    kind, n, crop = source
+    if kind == 'bldg':
+        return io.imread(f'images/bldg-{n}.jpg')[crop]
+    return shapes_image(shape, seed=n)
+
+
+def best_time(fn, repeat=3):
+    # best wall time of repeat calls, the least noisy estimate on a shared machine
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_kernel(kernel, repeat):
+    def build():
+        kernel_bank.cache_clear()
+        DonutCorners(**KERNELS[kernel])
+    return {'beam': best_time(build, repeat)}
+
+
+def bench_image(img, kernel, repeat, pooled=True):
+    dc = DonutCorners(**KERNELS[kernel])
+    dc.init(img)
+    out = {}
+
+    out['preprocess'] = best_time(dc.preprocess, repeat)
+
+    rng = np.random.RandomState(0)
+    points = np.stack([rng.randint(0, d, POINT_COUNT) for d in dc.dims], axis=-1)
+    out['score_point'] = best_time(lambda: [dc.score_point(p) for p in points], repeat) / POINT_COUNT
+
+    out['score_all_serial'] = best_time(lambda: dc.score_all(False, dense=True), repeat)
+    scored = dc.score_all(False, dense=True)
+
+    if pooled:
+        with dc:
+            dc.get_pool()
+            out['score_all_pooled'] = best_time(lambda: dc.score_all(True), repeat)
+
+    def search():
+        dc.init(img)
+        return dc.find_corners_grid(top_n=10)
+    out['find_corners_grid'] = best_time(search, repeat)
+    corners = search()
+
+    # accuracy fingerprints, any change here is a behavior change not a speed change
+    out['accuracy'] = {'score_sum': float(np.sum(scored)),
+                       'score_max': float(np.max(scored)),
+                       'corner_scores': [float(c[0]) for c in corners],
+                       'corner_points': [[int(v) for v in c[1]] for c in corners]}
+    return out
+
+
+def bench_transform(kernel, repeat):
+    img = io.imread('images/bldg-1.jpg').mean(axis=-1)
+    h, w = TRANSFORM_SHAPE
+    X = np.array([img[i*h : (i+1)*h, 700 + j*w : 700 + (j+1)*w].ravel()
+                  for i in range(TRANSFORM_COUNT // 4) for j in range(4)])
+
+    dc = DonutCorners(search_args={'img_shape': TRANSFORM_SHAPE, 'top_n': 3}, **KERNELS[kernel])
+    dc.fit(X)
+    out = {'transform': best_time(lambda: dc.transform(X), repeat)}
+    features = dc.transform(X)
+    out['accuracy'] = {'feature_sum': float(np.sum(features))}
+    return out
+
+
+def run(images, kernels, repeat=3, pooled=True):
+    results = {}
+    for kernel in kernels:
+        results[f'kernel/{kernel}'] = bench_kernel(kernel, repeat)
+        results[f'transform/{kernel}'] = bench_transform(kernel, repeat)
+        for name, source, shape in IMAGES:
+            if name in images:
+                results[f'{name}/{kernel}'] = bench_image(load_image(source, shape), kernel, repeat, pooled)
+                print(f'{name}/{kernel} done', file=sys.stderr)
+
+    meta = {'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare(current, baseline, tolerance=0.25, atol=1e-6):
+    # list of (case, stage, message) for timings slower than baseline by more than
+    # tolerance and accuracy fingerprints that moved by more than atol
+    problems = []
+    for case, stages in current['results'].items():
+        base = baseline['results'].get(case)
+        if base is None:
+            continue
+        for stage, value in stages.items():
+            if stage not in base:
+                continue
+            if stage == 'accuracy':
+                for key, v in value.items():
+                    b = base['accuracy'].get(key)
+                    if b is None:
+                        continue
+                    if np.shape(v) != np.shape(b) or not np.allclose(v, b, rtol=0, atol=atol):
+                        problems.append((case, f'accuracy.{key}', f'{b} -> {v}'))
+            elif value > base[stage] * (1 + tolerance):
+                problems.append((case, stage, f'{base[stage]:.4g}s -> {value:.4g}s ({value / base[stage]:.2f}x)'))
+    return problems
+
+
+def report(current, baseline=None):
+    for case, stages in current['results'].items():
+        base = (baseline or {'results': {}})['results'].get(case, {})
+        for stage, value in stages.items():
+            if stage == 'accuracy':
+                continue
+            line = f'{case:28s} {stage:20s} {value*1000:10.2f} ms'
+            if stage in base:
+                line += f'   baseline {base[stage]*1000:10.2f} ms  {value / base[stage]:5.2f}x'
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='time and fingerprint the DonutCorners pipeline')
+    parser.add_argument('--out', help='write the results json here')
+    parser.add_argument('--baseline', help='compare against this results json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 is 25%%')
+    parser.add_argument('--full', action='store_true', help='all images and kernel sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-pool', action='store_true', help='skip the pooled score_all timings')
+    args = parser.parse_args()
+
+    images = [name for name, _, _ in IMAGES] if args.full else QUICK_IMAGES
+    kernels = list(KERNELS) if args.full else QUICK_KERNELS
+    current = run(images, kernels, args.repeat, not args.no_pool)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(current, baseline)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=1)
+
+    if baseline is not None:
+        problems = compare(current, baseline, args.tolerance)
+        for case, stage, message in problems:
+            print(f'REGRESSION {case} {stage}: {message}')
+        sys.exit(1 if problems else 0)
@@ -1,5 +1,5 @@
 from visualizing_donut_corners import *
-from donut_corners import DonutCorners
+from donut_corners import DonutCorners, kernel_tables
 from skimage import io
 
 def test_rigidized():
@@ -49,7 +49,7 @@ def test_building(bldg_no = 1, crop = (slice(0,200), slice(650,950)), score_all
 
     import sys
     if score_all:
-        dc.score_all('pydevd' not in sys.modules)
+        dc.score_all('pydevd' not in sys.modules, dense=True)
     
     #dc.find_corner(np.array([50,70]))
     #dc.find_corners()#'pydevd' not in sys.modules)
@@ -76,6 +76,517 @@ def test_building(bldg_no = 1, crop = (slice(0,200), slice(650,950)), score_all
         show_img(im_2)
 
 
+def test_angle_symmetry(crop = (slice(0,150), slice(650,850))):
+    # sharing the sharpened planes of opposite beams gives the full bank's means, scores & corners
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    for beam in ({'angle_count': 48, 'beam_width': 2, 'beam_length': 10, 'beam_start': 3},
+                 {'angle_count': 24, 'beam_width': 3, 'beam_length': 7.5, 'beam_start': 2}):
+        for bake in (False, True):
+            results = {}
+            for symmetric in (False, True):
+                dc = DonutCorners(angle_symmetry=symmetric, bake_sharpened=bake,
+                                  eval_method={'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}, **beam)
+                dc.init(img)
+                results[symmetric] = (dc.beam_means(0, dc.dims[0]), dc.score_all(False, dense=True),
+                                      dc.find_corners_grid(top_n=10))
+            assert dc.plane_count == beam['angle_count'] // 2
+            if bake:
+                assert len(dc.sharpened) == dc.plane_count
+
+            full, halved = results[False], results[True]
+            assert np.allclose(halved[0], full[0], rtol=0, atol=1e-12)
+            assert np.allclose(halved[1], full[1], rtol=0, atol=1e-12)
+            assert [tuple(c[1]) for c in halved[2]] == [tuple(c[1]) for c in full[2]]
+
+    assert DonutCorners(angle_count=12 * 7, angle_symmetry=True).plane_count == 42
+    assert DonutCorners(angle_count=30, angle_symmetry=False).plane_count == 30
+
+
+def test_beam_sums():
+    # empty angles sum to zero and leave the segments around them whole, trailing ones too
+    spiral = np.zeros((6, 5, 5))
+    spiral[0, 0, :] = 1
+    spiral[1, 1, :] = 2
+    spiral[3, 2, :2] = 3
+    tables = kernel_tables(spiral)
+    assert np.array_equal(tables['beam_indptr'], [0, 5, 10, 10, 12, 12, 12])
+
+    dc = DonutCorners(angle_count=12, beam_length=5, beam_start=1)
+    dc.__dict__.update(tables)
+    vals = np.random.RandomState(0).rand(4, len(tables['beam_index']))
+    expected = np.stack([vals[:, a:b].sum(axis=-1) for a, b in
+                         zip(tables['beam_indptr'][:-1], tables['beam_indptr'][1:])], axis=-1)
+    assert np.allclose(dc.beam_sums(vals), expected)
+
+
+def test_dense_scoring(crop = (slice(0,40), slice(700,760))):
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 48,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+
+    dense = dc.score_all(False, dense=True)
+    for point in np.ndindex(*dense.shape):
+        assert np.isclose(dense[point], dc.score_point(point)[0])
+
+
+def test_numba_backend(crop = (slice(0,150), slice(650,850))):
+    # the numba kernels give the same beams & corners as numpy, baked or not
+    import pytest
+    pytest.importorskip('numba')
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    rng = np.random.RandomState(0)
+    points = np.stack([rng.randint(0, 150, 500), rng.randint(0, 200, 500)], axis=-1)
+    for bake in (False, True):
+        results = []
+        for backend in ('numpy', 'numba'):
+            dc = DonutCorners(backend=backend, bake_sharpened=bake, **kwargs)
+            dc.init(img)
+            results.append((dc.score_points(points), dc.find_corners_grid(top_n=10)))
+
+        (np_points, np_corners), (nb_points, nb_corners) = results
+        assert np.allclose(np_points[0], nb_points[0])
+        assert np.array_equal(np_points[3], nb_points[3])
+        assert [tuple(c[1]) for c in np_corners] == [tuple(c[1]) for c in nb_corners]
+        assert np.allclose([c[0] for c in np_corners], [c[0] for c in nb_corners])
+
+
+def test_update(crop = (slice(0,150), slice(650,850))):
+    # updating two edited rectangles gives the same planes & scores as a fresh init,
+    # and nothing left in the point cache is stale
+    img = io.imread('images/bldg-1.jpg')[crop]
+    new = img.copy()
+    new[40:70, 60:110] = 255
+    new[130:150, 0:30] = 0
+    rects = [(40, 70, 60, 110), (130, 150, 0, 30)]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'bake_sharpened': True,
+            'eval_method': {'elimination_width': 2, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+    dc.score_all(False, dense=True)
+    dc.find_corners_grid()
+    corners = dc.update(new, rects)
+
+    ref = DonutCorners(**kwargs)
+    ref.init(new)
+    scored = ref.score_all(False, dense=True)
+
+    assert np.array_equal(dc.polar, ref.polar)
+    assert np.array_equal(dc.sharpened, ref.sharpened)
+    assert np.array_equal(dc.scored, scored)
+
+    points = np.array(list(dc.point_info))
+    cached = np.array([dc.point_info[tuple(p)][0] for p in points])
+    assert np.allclose(cached, ref.score_points(points)[0])
+
+    # the search is path dependent, so only most of the top corners have to agree with a
+    # fresh search, but none may be listed twice and all must carry their current score
+    fresh = ref.find_corners_grid()
+    found = [tuple(c[1]) for c in dc.corners]
+    assert len(found) == len(set(found))
+    assert len({tuple(c[1]) for c in corners} & {tuple(c[1]) for c in fresh}) >= 8
+    assert np.allclose([c[0] for c in corners], ref.score_points([c[1] for c in corners])[0])
+
+    partial = dc.scored_partial
+    assert np.array_equal(partial, dc.point_info.arrays()[0], equal_nan=True)
+    assert np.count_nonzero(~np.isnan(partial)) == len(points)
+
+    # small random edits, walks from them climb to maxima outside the edit that are already known
+    img = io.imread('images/bldg-1.jpg')[:200, 650:950]
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        new, rects = img.copy(), []
+        for _ in range(3):
+            y, x = rng.randint(0, 185), rng.randint(0, 285)
+            new[y:y+15, x:x+15] = rng.randint(0, 255)
+            rects.append((y, y+15, x, x+15))
+
+        dc = DonutCorners(**kwargs)
+        dc.init(img)
+        dc.find_corners_grid()
+        corners = dc.update(new, rects)
+        found = [tuple(c[1]) for c in dc.corners]
+        assert len(found) == len(set(found))
+
+        ref = DonutCorners(**kwargs)
+        ref.init(new)
+        fresh = ref.find_corners_grid()
+        assert len({tuple(c[1]) for c in corners} & {tuple(c[1]) for c in fresh}) >= 8
+
+
+def test_track(crop = (slice(0,150), slice(650,850))):
+    # tracking a moving patch keeps the fresh search's corners with current scores, never rescores
+    # a cached point outside the dirty mask and searches a frame of a new shape from scratch
+    img = io.imread('images/bldg-1.jpg')[crop]
+    frames = []
+    for k in range(4):
+        frame = img.copy()
+        frame[40+3*k : 70+3*k, 60+2*k : 90+2*k] = 255
+        frames.append(frame)
+    frames.append(io.imread('images/bldg-1.jpg')[:120, 700:860])
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 2, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    masks, scored = [], []
+    dirty_mask, score_points, score_point = dc.dirty_mask, dc.score_points, dc.score_point
+    dc.dirty_mask = lambda prev_bw: masks.append(dirty_mask(prev_bw)) or masks[-1]
+    dc.score_points = lambda points: scored.extend(map(tuple, np.reshape(points, (-1, 2)))) or score_points(points)
+    dc.score_point = lambda point: scored.append(tuple(point)) or score_point(point)
+
+    cached = set()
+    for k, (frame, corners) in enumerate(zip(frames, dc.track(iter(frames), top_n=10))):
+        ref = DonutCorners(**kwargs)
+        ref.init(frame)
+        fresh = ref.find_corners_grid(top_n=10)
+
+        if k in (0, len(frames) - 1):
+            assert [tuple(c[1]) for c in corners] == [tuple(c[1]) for c in fresh]
+        else:
+            # the tracker also keeps corners the grid search misses, most of the fresh ones must be among them
+            dists = np.linalg.norm(np.array([c[1] for c in fresh])[:,None]
+                                   - np.array([c[1] for c in dc.corners])[None], axis=-1)
+            assert np.mean(dists.min(1) <= 2) >= 0.7
+            assert len(masks) == k
+            assert not any(p in cached and not masks[-1][p] for p in scored)
+        assert np.allclose([c[0] for c in corners], ref.score_points([c[1] for c in corners])[0])
+
+        cached, scored[:] = set(dc.point_info), []
+    assert len(masks) == len(frames) - 2
+
+
+def test_score_tiled(crop = (slice(0,120), slice(650,830)), tiles = (37, 64)):
+    # tiled scoring from a memmapped .npy matches in-memory dense scoring, and every
+    # corner record is a local maximum above min_corner_score
+    import tempfile, os
+    from scipy import ndimage
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'min_corner_score': 0.2,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+    full = dc.score_all(False, dense=True)
+    peaks = (full == ndimage.maximum_filter(full, size=3)) & (full > dc.min_corner_score)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        np.save(os.path.join(tmp, 'src.npy'), img)
+        for tile in tiles:
+            prefix = os.path.join(tmp, f'tile{tile}')
+            scored, corners = DonutCorners(**kwargs).score_tiled(os.path.join(tmp, 'src.npy'), prefix, tile=tile)
+
+            assert np.array_equal(np.asarray(scored), full)
+            assert len(corners) == np.count_nonzero(peaks)
+            y, x = corners['point'].T
+            assert np.all(peaks[y, x])
+            assert np.all(corners['score'] > dc.min_corner_score)
+            assert np.array_equal(corners['score'], full[y, x])
+            del scored, corners
+
+
+def test_score_shared(crop = (slice(0,80), slice(650,770))):
+    # the shared memory tiled pool gives exactly the serial dense scores, baked or not, in both precisions
+    import donut_corners
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'n_workers': 2,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    band_bytes = donut_corners.DENSE_BAND_BYTES
+    donut_corners.DENSE_BAND_BYTES = 2**16 # 18 pixel tiles, many per image
+    try:
+        for dtype in ('float64', 'float32'):
+            for bake in (False, True):
+                with DonutCorners(dtype=dtype, bake_sharpened=bake, **kwargs) as dc:
+                    dc.init(img)
+                    assert len(list(dc.tiles())) > 4
+                    assert (dc.sharpened is not None) == bake
+                    serial = dc.score_all(False, dense=True)
+                    shared = dc.score_all(True)
+                    assert shared.dtype == serial.dtype == np.dtype(dtype)
+                    assert np.array_equal(shared, serial)
+    finally:
+        donut_corners.DENSE_BAND_BYTES = band_bytes
+
+
+def test_conv_backends(crop = (slice(0,100), slice(650,800))):
+    # fft, overlap-add and auto correlations give the direct beam means & dense scores
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 48,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    results = {}
+    for backend in ('direct', 'fft', 'oa', 'auto'):
+        dc = DonutCorners(conv_backend=backend, **kwargs)
+        dc.init(img)
+        results[backend] = dc.beam_means(0, dc.dims[0]), dc.score_all(False, dense=True)
+
+    means, scored = results['direct']
+    for backend in ('fft', 'oa', 'auto'):
+        assert np.allclose(results[backend][0], means, rtol=0, atol=1e-12)
+        assert np.allclose(results[backend][1], scored, rtol=0, atol=1e-12)
+
+
+def test_reduced_precision(crop = (slice(0,100), slice(650,800))):
+    # float32 pipeline & float16 baked planes stay close to the float64 scores
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 48,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'conv_backend': 'direct',
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+    full = dc.score_all(False, dense=True)
+
+    for dtype, bake, tol in (('float32', False, 1e-4), ('float32', True, 1e-4), ('float16', True, 0.03)):
+        dc = DonutCorners(dtype=dtype, bake_sharpened=bake, **kwargs)
+        dc.init(img)
+        scored = dc.score_all(False, dense=True)
+        assert scored.dtype == np.float32
+        assert np.abs(scored - full).max() <= tol * full.max()
+
+
+def test_search_order(crop = (slice(0,150), slice(650,850))):
+    # best first finds the fifo corners when unbounded, and a budget caps the new evaluations
+    # at eval_budget plus the one ray batch that crosses it
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+    batch = 2 * 3 * kwargs['eval_method']['max_n'] # double ended rays at three distances
+
+    dc = DonutCorners(**kwargs)
+    results = {}
+    for order in ('fifo', 'best'):
+        dc.init(img)
+        results[order] = dc.find_corners_grid(top_n=10, search_order=order)
+        assert len(dc.point_info) > 1000
+    assert [tuple(c[1]) for c in results['best']] == [tuple(c[1]) for c in results['fifo']]
+    assert [c[0] for c in results['best']] == [c[0] for c in results['fifo']]
+
+    for budget in (1, 50, 200, 700):
+        for order in ('fifo', 'best'):
+            dc.init(img)
+            results[order] = dc.find_corners_grid(top_n=10, search_order=order, eval_budget=budget)
+            assert budget <= len(dc.point_info) <= budget + batch
+
+        # the strongest branches go first, so a tight budget finds at least as many corners
+        assert len(results['best']) >= len(results['fifo'])
+
+    dc.set_params(search_order='best', eval_budget=200)
+    dc.init(img)
+    dc.find_corners_grid(top_n=10)
+    assert len(dc.point_info) <= 200 + batch
+
+
+def test_stats(crop = (slice(0,100), slice(700,850))):
+    # the per mode evaluation counts match the searches of each mode and stats leave results alone
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    plain = DonutCorners(**kwargs)
+    plain.init(img)
+    expected = plain.find_corners_grid(top_n=5)
+
+    dc = DonutCorners(stats=True, **kwargs)
+    dc.init(img)
+
+    # count the evaluations of each ray search on the side, its longest ray gives its mode
+    counted = dict.fromkeys(range(1, 6), 0)
+    search_rays = dc.search_rays
+    def counting(point, angles, dists, info):
+        before = len(dc.point_info)
+        result = search_rays(point, angles, dists, info)
+        counted[{7: 2, 5.6: 3, 1.4: 4, 20: 5}[round(max(dists), 6)]] += len(dc.point_info) - before
+        return result
+    dc.search_rays = counting
+
+    corners = dc.find_corners_grid(top_n=5)
+    counted[1] = len(dc.point_info) - sum(counted.values())
+
+    assert [c[0] for c in corners] == [c[0] for c in expected]
+    assert sum(dc.stats.evals.values()) == dc.stats.misses == len(dc.point_info)
+    assert dc.stats.calls['search'] == 1 and dc.stats.queue_max > 0
+    assert dc.stats.evals == counted
+    assert dc.stats.steps[1] == len(dc.grid_points())
+
+
+def test_parallel_transform():
+    # pooled transform matches the serial one, sizes its own pool from each call's n_jobs
+    # and uses a caller's pool as is
+    img = io.imread('images/bldg-1.jpg').mean(axis=-1)
+    X = np.array([img[i*32:(i+1)*32, 700+j*32:700+(j+1)*32].ravel() for i in range(3) for j in range(4)])
+
+    dc = DonutCorners(angle_count=12, beam_length=5, beam_start=1,
+                      search_args={'img_shape': (32, 32), 'top_n': 3})
+    dc.fit(X)
+    serial = dc.transform(X)
+
+    with dc:
+        for n_jobs in (2, 3):
+            assert np.allclose(dc.transform(X, n_jobs=n_jobs), serial, equal_nan=True)
+            assert dc.pool_size == n_jobs
+        assert dc.n_workers is None
+
+    # a caller's executor is reused as given, no pool of our own is started
+    from concurrent.futures import ProcessPoolExecutor
+    new_pool, started = vars(DonutCorners)['new_pool'], []
+    DonutCorners.new_pool = staticmethod(lambda processes: started.append(processes) or new_pool.__func__(processes))
+    try:
+        with ProcessPoolExecutor(2) as ex:
+            dc.set_params(pool=ex)
+            for n_jobs in (2, 3):
+                assert np.allclose(dc.transform(X, n_jobs=n_jobs), serial, equal_nan=True)
+    finally:
+        DonutCorners.new_pool = new_pool
+    assert started == [] and dc.pool is ex and not dc.owns_pool
+
+
+def test_transform_batches():
+    # concatenated batches equal transform, pixels imputed too, fitted or not
+    img = io.imread('images/bldg-1.jpg').mean(axis=-1)
+    X = np.array([img[i*32:(i+1)*32, 700+j*32:700+(j+1)*32].ravel() for i in range(3) for j in range(4)])
+    X[1, :40] = np.nan
+    X[5, 100:110] = np.nan
+
+    dc = DonutCorners(angle_count=12, beam_length=5, beam_start=1,
+                      search_args={'img_shape': (32, 32), 'top_n': 3})
+    for fitted in (False, True):
+        if fitted:
+            dc.fit(X)
+        full = dc.transform(X.copy())
+        batched = np.vstack(list(dc.transform_batches(X.copy(), batch_size=5)))
+        assert not np.isnan(batched).any()
+        assert np.allclose(batched, full)
+
+
+def test_parallel_search(crop = (slice(0,150), slice(650,850))):
+    # the parallel search scores the same points and finds the same corners as the serial one
+    img = io.imread('images/bldg-1.jpg')[crop]
+
+    kwargs = {'angle_count': 24,
+            'beam_width': 2,
+            'beam_length': 10,
+            'beam_start': 3,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': True}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+    serial = dc.find_corners_grid(top_n=10)
+
+    with DonutCorners(n_workers=2, **kwargs) as par:
+        par.init(img)
+        corners = par.find_corners_grid(multithread=True, top_n=10)
+        assert set(par.point_info) == set(dc.point_info)
+        assert [tuple(c[1]) for c in corners] == [tuple(c[1]) for c in serial]
+        assert np.allclose([c[0] for c in corners], [c[0] for c in serial])
+
+        # the budget is shared out between the workers
+        par.init(img)
+        par.find_corners_grid(multithread=True, eval_budget=500)
+        assert len(par.point_info) < len(dc.point_info)
+
+
+def test_pyramid(bldg_no = 1, crop = (slice(0,400), slice(500,1100)), levels = (2, 3), top_n = 20, radius = 5):
+    # report speed & agreement of the pyramid search against the full resolution grid search,
+    # the pyramid has to find most of the same corners at about the same strength
+    import time
+    img = io.imread(f'images/bldg-{bldg_no}.jpg')
+    if crop is not None:
+        img = img[crop]
+
+    kwargs = {'angle_count': 48,
+            'beam_width': 2,
+            'fork_spread': 2,
+            'beam_length': 20,
+            'beam_start': 5,
+            'min_corner_score': 0.1,
+            'bake_sharpened': True,
+            'eval_method': {'elimination_width': 3, 'max_n': 3, 'elim_double_ends': False}
+            }
+
+    dc = DonutCorners(**kwargs)
+    dc.init(img)
+    t0 = time.time()
+    full = dc.find_corners_grid(top_n=top_n)
+    t_full = time.time() - t0
+    print(f'full: {t_full:.2f}s, {len(dc.point_info)} points scored, mean score {np.mean([c[0] for c in full]):.3f}')
+
+    for n in levels:
+        dc = DonutCorners(**kwargs)
+        dc.init(img)
+        t0 = time.time()
+        pyr = dc.find_corners_pyramid(top_n=top_n, levels=n)
+        t_pyr = time.time() - t0
+
+        dists = np.linalg.norm(np.array([c[1] for c in full])[:,None] - np.array([c[1] for c in pyr])[None], axis=-1)
+        print(f'{n} levels: {t_pyr:.2f}s ({t_full/t_pyr:.1f}x), {len(dc.point_info)} points scored, '
+              f'mean score {np.mean([c[0] for c in pyr]):.3f}, '
+              f'recall {np.mean(dists.min(1) <= radius):.0%}, precision {np.mean(dists.min(0) <= radius):.0%}')
+        assert np.mean(dists.min(1) <= radius) >= 0.4
+        assert np.mean([c[0] for c in pyr]) >= 0.9 * np.mean([c[0] for c in full])
+
+
 def beam_demo():
     kwargs = {'angle_count': 16, # must be multiple of 4
             'beam_width': 4,
@@ -1,12 +1,472 @@
 from skimage import io
+from skimage.transform import downscale_local_mean
 import numpy as np
+from scipy import signal, ndimage
+from scipy import fft as sp_fft
 
 from collections import deque
+from itertools import count
+import heapq
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
 
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool, Manager, Lock, cpu_count, shared_memory, resource_tracker
+from concurrent.futures import ThreadPoolExecutor
 from math import pi, atan2, sqrt
+import os
 import random
-# import numba
+import time
+import warnings
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+DENSE_BAND_BYTES = 2**27
+IMAGE_STATE = ('src', 'bw', 'uv', 'polar', 'sharpened', 'sharpened_key', 'scored',
+               'point_info', 'basins', 'corners', 'workspace', 'gather')
+
+
+POINT_TILE = 64 # side of the lazily allocated PointCache tiles
+SHARED_KEYS = ('angle_count', 'beam_length', 'beam_diameter', 'baked_angles', 'eval_method',
+               'conv_backend', 'sharpen_power', 'dims', 'dtype', 'plane_count')
+FFT_COST = 1.0 # cost of one fft element*log2 relative to one direct kernel tap
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _nb_sharpen(angle1, angle2, power_mult):
+        angle_delta = abs((angle1 - angle2)%pi - (pi/2))
+        return np.exp(-power_mult*angle_delta)
+
+
+    @numba.njit(cache=True)
+    def _nb_get_max_idx(vals, w, no_doubles):
+        n = len(vals)
+        arg = np.argmax(vals)
+        val = vals[arg]
+        for i in range(arg - w, arg + w + 1):
+            vals[i % n] = 0
+            if no_doubles:
+                vals[(i % n + n//2) % n] = 0 #eliminate double counting of edges
+        return arg, val
+
+
+    @numba.njit(cache=True)
+    def _nb_select(means, w, no_doubles, max_n):
+        ids = np.empty(max_n, dtype=np.int64)
+        strengths = np.empty(max_n)
+        for j in range(max_n):
+            ids[j], strengths[j] = _nb_get_max_idx(means, w, no_doubles)
+        return ids, strengths
+
+
+    @numba.njit(cache=True)
+    def _nb_score_points_polar(polar, points, offsets, weights, counts, angles, power, w, no_doubles, max_n):
+        ids = np.empty((len(points), max_n), dtype=np.int64)
+        strengths = np.empty((len(points), max_n))
+        for p in range(len(points)):
+            y, x = points[p, 0], points[p, 1]
+            means = np.zeros(len(counts))
+            for k in range(len(offsets)):
+                a, py, px = offsets[k, 0], y + offsets[k, 1], x + offsets[k, 2]
+                means[a] += weights[k] * _nb_sharpen(polar[py, px, 0], angles[a], power) * polar[py, px, 1]
+            means = np.abs(means / counts)
+            ids[p], strengths[p] = _nb_select(means, w, no_doubles, max_n)
+        return ids, strengths
+
+
+    @numba.njit(cache=True)
+    def _nb_score_points_baked(sharpened, points, offsets, planes, weights, counts, w, no_doubles, max_n):
+        ids = np.empty((len(points), max_n), dtype=np.int64)
+        strengths = np.empty((len(points), max_n))
+        for p in range(len(points)):
+            y, x = points[p, 0], points[p, 1]
+            means = np.zeros(len(counts))
+            for k in range(len(offsets)):
+                means[offsets[k, 0]] += weights[k] * sharpened[planes[k], y + offsets[k, 1], x + offsets[k, 2]]
+            means = np.abs(means / counts)
+            ids[p], strengths[p] = _nb_select(means, w, no_doubles, max_n)
+        return ids, strengths
+
+# kernel banks
+KERNEL_CACHE_SIZE = 32
+
+def make_spiral(angle_count, beam_width, fork_spread, beam_length, beam_start):
+    r, d, ir = beam_length, 1 + beam_length * 2, beam_start
+    w, spr, count = beam_width, fork_spread, angle_count
+
+    di = int(d)
+    delta = np.moveaxis(np.indices((di,di)), 0, -1) - d//2
+
+    beam_angles = np.linspace(0,2*pi, count, endpoint=False)
+    
+    beam_uvs = np.stack((-np.sin(beam_angles), np.cos(beam_angles)), axis=-1)
+    beam_perps = np.matmul(beam_uvs, DonutCorners.rot90)
+
+    len_on_line = np.einsum('ijk,ak->aij', delta, beam_uvs)
+    dist_to_line = np.einsum('ijk,ak->aij', delta, beam_perps)
+    
+    # make the prongs
+    spiral = np.maximum(w / 2 - np.abs(dist_to_line), 0)
+
+    # clip to length & side
+    spiral[(len_on_line < ir) | (len_on_line > r)] = 0
+
+    # normalize
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spiral = spiral / np.sum(spiral, axis=(1,2))[:, None, None]
+
+    # error checking
+    if np.any(np.isnan(spiral)):
+        raise ValueError('invalid beam values, getting nans in kernel')
+
+    return spiral
+
+
+def kernel_tables(spiral, plane_count=None):
+    # with plane_count half the kernels, angle a + plane_count reads the sharpened plane of angle a,
+    # theta and theta + pi sharpen identically so only the planes are shared, never the kernels
+    angle_count = len(spiral)
+    plane_count = plane_count or angle_count
+    spiral_mask = spiral != 0
+    spiral = spiral.astype('float32')
+    beam_offsets = np.argwhere(spiral_mask)
+    beam_weights = spiral[spiral_mask]
+    beam_counts = np.bincount(beam_offsets[:,0], minlength=angle_count)
+    beam_index = beam_offsets[...,0]
+    beam_jumps = np.argwhere(beam_index[1:] != beam_index[:-1]).flatten() + 1
+
+    # csr layout, the pixels of angle a are beam_offsets[beam_indptr[a] : beam_indptr[a+1]]
+    # the jumps only mark angles that have pixels, empty angles get zero width segments
+    beam_indptr = np.zeros(angle_count + 1, dtype=np.intp)
+    beam_indptr[beam_index[np.r_[0, beam_jumps]] + 1] = np.diff(np.r_[0, beam_jumps, len(beam_index)])
+    beam_indptr = np.cumsum(beam_indptr)
+
+    return {'spiral': spiral,
+            'spiral_mask': spiral_mask,
+            'weights': tuple(np.split(beam_weights, np.cumsum(beam_counts)[:-1])),
+            'beam_offsets': beam_offsets,
+            'beam_weights': beam_weights,
+            'beam_counts': beam_counts,
+            'beam_index': beam_index,
+            'beam_planes': beam_index % plane_count, # sharpened plane of each pixel
+            'plane_count': plane_count,
+            'beam_jumps': beam_jumps,
+            'beam_indptr': beam_indptr,
+            'beam_starts': beam_indptr[:-1][beam_counts > 0], # reduceat needs strictly increasing starts
+            'beam_filled': np.flatnonzero(beam_counts > 0),
+            'beam_empty': np.flatnonzero(beam_counts == 0)}
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def kernel_bank(angle_count, beam_width, fork_spread, beam_length, beam_start, symmetric=False):
+    # banks are shared by every instance with the same beam, so they are read-only
+    spiral = make_spiral(angle_count, beam_width, fork_spread, beam_length, beam_start)
+
+    # opposite beams share a sharpened plane, which needs the angle + pi to be a baked angle
+    halved = symmetric and angle_count % 2 == 0
+    bank = kernel_tables(spiral, angle_count // 2 if halved else angle_count)
+    for arr in bank.values():
+        if isinstance(arr, np.ndarray):
+            arr.flags.writeable = False
+    for arr in bank['weights']:
+        arr.flags.writeable = False
+    return bank
+
+
+# shared memory workers
+SEARCH_LOCKS = 64 # lock stripes guarding pixel claims in the parallel search
+_worker_state = {}
+
+
+def _init_worker(locks):
+    _worker_state['locks'] = locks
+
+def _shm_share(arrays):
+    blocks, specs = {}, {}
+    for name, arr in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+        blocks[name] = block
+        specs[name] = (block.name, arr.shape, arr.dtype.str)
+    return blocks, specs
+
+
+def _shm_attach(specs):
+    # attach once per set of blocks, the parent owns and unlinks them
+    key = tuple(sorted(spec[0] for spec in specs.values()))
+    if _worker_state.get('key') != key:
+        for block in _worker_state.get('blocks', []):
+            block.close()
+        blocks = {name: shared_memory.SharedMemory(name=spec[0]) for name, spec in specs.items()}
+        _worker_state['key'] = key
+        _worker_state['blocks'] = list(blocks.values())
+        _worker_state['arrays'] = {name: np.ndarray(specs[name][1], dtype=specs[name][2],
+            buffer=block.buf) for name, block in blocks.items()}
+    return _worker_state['arrays']
+
+
+def _score_tile(task):
+    params, specs, (y0, y1, x0, x1) = task
+    arrays = _shm_attach(specs)
+
+    dc = DonutCorners.__new__(DonutCorners)
+    dc.__dict__.update(params)
+    dc.polar = arrays.get('polar')
+    dc.sharpened = arrays.get('sharpened')
+    dc.set_kernels(arrays['spiral'])
+
+    arrays['scored'][y0:y1, x0:x1] = dc.select_beams(dc.beam_means(y0, y1, x0, x1))[0]
+
+
+class PointCache():
+    # scored point infos in fixed-width per-tile record arrays, allocated on first write
+    # behaves like the old {point: (score, angles, beam_strengths, beam_ids)} dict
+    def __init__(self, dims, max_n, baked_angles, tile=POINT_TILE, float_type='f8'):
+        self.dims = tuple(int(d) for d in dims)
+        self.max_n = max_n
+        self.baked_angles = baked_angles
+        self.tile = tile
+        self.float_type = np.dtype(float_type)
+        self.dtype = np.dtype([('score', self.float_type), ('strengths', self.float_type, (max_n,)),
+                               ('ids', 'i4', (max_n,)), ('valid', '?')])
+        self.tiles = {}
+        self.count = 0
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __iter__(self):
+        for (ty, tx), tile in self.tiles.items():
+            for y, x in np.argwhere(tile['valid']):
+                yield (int(ty*self.tile + y), int(tx*self.tile + x))
+
+
+    def __contains__(self, tp):
+        tile = self.tiles.get((tp[0] // self.tile, tp[1] // self.tile))
+        return tile is not None and bool(tile['valid'][tp[0] % self.tile, tp[1] % self.tile])
+
+
+    def __getitem__(self, tp):
+        tile = self.tiles.get((tp[0] // self.tile, tp[1] // self.tile))
+        if tile is None or not tile['valid'][tp[0] % self.tile, tp[1] % self.tile]:
+            raise KeyError(tp)
+        rec = tile[tp[0] % self.tile, tp[1] % self.tile]
+        ids = rec['ids'].astype(int)
+        return rec['score'], self.baked_angles[ids], rec['strengths'].copy(), ids
+
+
+    def __setitem__(self, tp, info):
+        tile = self.get_tile((tp[0] // self.tile, tp[1] // self.tile))
+        rec = tile[tp[0] % self.tile, tp[1] % self.tile]
+        self.count += not rec['valid']
+        rec['score'], rec['strengths'], rec['ids'], rec['valid'] = info[0], info[2], info[3], True
+
+
+    def reset(self):
+        # forget every point but keep the allocated tiles for the next image
+        for tile in self.tiles.values():
+            tile['valid'] = False
+        self.count = 0
+
+
+    def invalidate(self, mask):
+        # forget the points where the full size mask is set
+        t = self.tile
+        for (ty, tx), tile in self.tiles.items():
+            part = mask[ty*t : ty*t + t, tx*t : tx*t + t]
+            h, w = part.shape
+            drop = tile['valid'][:h, :w] & part
+            self.count -= np.count_nonzero(drop)
+            tile['valid'][:h, :w][drop] = False
+
+
+    def get_tile(self, key):
+        if key not in self.tiles:
+            self.tiles[key] = np.zeros((self.tile, self.tile), dtype=self.dtype)
+        return self.tiles[key]
+
+
+    def set_many(self, points, scores, strengths, ids):
+        points = np.asarray(points, dtype=int).reshape(-1, 2)
+        scores = np.broadcast_to(scores, len(points))
+        keys = points // self.tile
+        for key in np.unique(keys, axis=0):
+            sel = np.all(keys == key, axis=1)
+            tile = self.get_tile(tuple(key))
+            y, x = (points[sel] % self.tile).T
+            self.count += np.count_nonzero(~tile['valid'][y, x])
+            tile['score'][y, x] = scores[sel]
+            tile['strengths'][y, x] = strengths[sel]
+            tile['ids'][y, x] = ids[sel]
+            tile['valid'][y, x] = True
+
+
+    def arrays(self):
+        # full size views of the cache: score (nan where unscored), strengths, ids, valid
+        t = self.tile
+        score = np.full(self.dims, np.nan, dtype=self.float_type)
+        strengths = np.zeros(self.dims + (self.max_n,), dtype=self.float_type)
+        ids = np.zeros(self.dims + (self.max_n,), dtype=np.int64)
+        valid = np.zeros(self.dims, dtype=bool)
+        for (ty, tx), tile in self.tiles.items():
+            h, w = min(t, self.dims[0] - ty*t), min(t, self.dims[1] - tx*t)
+            region = (slice(ty*t, ty*t + h), slice(tx*t, tx*t + w))
+            part = tile[:h, :w]
+            score[region] = np.where(part['valid'], part['score'], np.nan)
+            strengths[region], ids[region], valid[region] = part['strengths'], part['ids'], part['valid']
+        return score, strengths, ids, valid
+
+
+    def scores(self):
+        # full size score plane only, nan where unscored
+        t = self.tile
+        score = np.full(self.dims, np.nan, dtype=self.float_type)
+        for (ty, tx), tile in self.tiles.items():
+            h, w = min(t, self.dims[0] - ty*t), min(t, self.dims[1] - tx*t)
+            part = tile[:h, :w]
+            score[ty*t : ty*t + h, tx*t : tx*t + w] = np.where(part['valid'], part['score'], np.nan)
+        return score
+
+
+    def items(self):
+        score, strengths, ids, valid = self.arrays()
+        for tp in map(tuple, np.argwhere(valid)):
+            yield tp, (score[tp], self.baked_angles[ids[tp]], strengths[tp], ids[tp])
+
+
+class SharedPointInfo():
+    # point_info backed by shared arrays so parallel searches never score a pixel twice
+    # state is 0 for unscored, the worker id while a worker scores it and -1 once stored
+    DONE = -1
+
+    def __init__(self, arrays, locks, worker_id, baked_angles):
+        self.score = arrays['score']
+        self.strengths = arrays['strengths']
+        self.ids = arrays['ids']
+        self.state = arrays['state']
+        self.locks = locks
+        self.worker_id = worker_id
+        self.baked_angles = baked_angles
+        self.evaluated = 0
+
+
+    def __len__(self):
+        return self.evaluated
+
+
+    def __contains__(self, tp):
+        # claims the pixel for this worker when nobody has it yet
+        if self.state[tp] == 0:
+            with self.locks[(tp[0] * self.state.shape[1] + tp[1]) % len(self.locks)]:
+                if self.state[tp] == 0:
+                    self.state[tp] = self.worker_id
+                    return False
+        return self.state[tp] != self.worker_id
+
+
+    def __getitem__(self, tp):
+        while self.state[tp] != self.DONE:
+            time.sleep(0) # another worker is still scoring it
+        ids = self.ids[tp]
+        return self.score[tp], self.baked_angles[ids], self.strengths[tp], ids
+
+
+    def __setitem__(self, tp, info):
+        self.score[tp] = info[0]
+        self.strengths[tp] = info[2]
+        self.ids[tp] = info[3]
+        self.state[tp] = self.DONE
+        self.evaluated += 1
+
+
+def _search_seeds(task):
+    dc, specs, seeds, worker_id, locks, kwargs = task
+    arrays = _shm_attach(specs)
+
+    dc.polar = arrays.get('polar')
+    dc.sharpened = arrays.get('sharpened')
+    dc.point_info = SharedPointInfo(arrays, locks or _worker_state['locks'], worker_id, dc.baked_angles)
+    dc.corners = []
+
+    dc.find_corners_grid(seeds=seeds, **kwargs)
+    return dc.corners
+
+
+class RunningMean():
+    # column means ignoring nans, accumulated one block at a time
+    def __init__(self, width):
+        self.sums = np.zeros(width)
+        self.counts = np.zeros(width, dtype=int)
+
+
+    def update(self, block):
+        known = ~np.isnan(block)
+        self.sums += np.where(known, block, 0).sum(axis=0)
+        self.counts += known.sum(axis=0)
+
+
+    @property
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+
+class SearchStats():
+    # opt-in counters & stage timers, pass stats=True or a SearchStats to DonutCorners
+    # callback(stage, seconds, stats) is called each time a timed stage finishes
+    # pooled workers count into their own copies, only the calling process is recorded
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+
+    def reset(self):
+        self.steps = dict.fromkeys(range(1, 6), 0) # queue entries processed per search mode
+        self.evals = dict.fromkeys(range(1, 6), 0) # new score evaluations per search mode
+        self.hits = 0
+        self.misses = 0
+        self.queue_max = 0
+        self.times = {}
+        self.calls = {}
+
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        if self.callback is not None:
+            self.callback(stage, seconds, self)
+
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+
+    def summary(self):
+        return {'steps': dict(self.steps), 'evals': dict(self.evals), 'hits': self.hits,
+                'misses': self.misses, 'hit_ratio': self.hit_ratio, 'queue_max': self.queue_max,
+                'times': dict(self.times), 'calls': dict(self.calls)}
+
+
+def _transform_chunk(task):
+    dc, imgs = task
+    return dc.corner_features(imgs)
+
 
 class DonutCorners():
     rot90 = np.array([[0, -1], [1, 0]])
@@ -19,6 +479,16 @@ class DonutCorners():
         self.top_n = None
         self.engineered_only = False
 
+        # parallel transform: n_jobs=None runs serially, -1 uses every core
+        self.n_jobs = None
+        self.chunk_size = None
+        self.prefer = 'processes' # or 'threads'
+        self.batch_size = 1000
+
+        # imputation values learned by fit
+        self.fill_values = None
+        self.pixel_fill_values = None
+
         # beam & lighthouse
         self.angle_count = 12
         self.beam_width = 3
@@ -29,129 +499,548 @@ class DonutCorners():
 
         self.eval_method = {'elimination_width': self.angle_count // 30, 'max_n': 3, 'elim_double_ends': True}
 
+        # dense scoring backend: 'direct', 'fft', 'oa' (overlap-add) or 'auto'
+        self.conv_backend = 'auto'
+
+        # sharpening & baked planes
+        self.sharpen_power = 10
+        self.bake_sharpened = False
+        self.bake_max_bytes = 2**30
+        self.sharpened = None
+        self.sharpened_key = None
+
+        # float type of the gradient, polar, sharpened and score arrays, 'float64' or 'float32'
+        # 'float16' keeps the baked planes in half precision and everything else in float32
+        self.dtype = 'float64'
+
+        # bake sharpened planes for half the angles, opposite beams sharpen identically and share them
+        self.angle_symmetry = True
+
+        # 'numpy' or 'numba' for score_point and search_rays
+        self.backend = 'numpy'
+
+        # worker pool, created on first use unless one is passed in
+        self.pool = None
+        self.owns_pool = False
+        self.pool_size = None # size of the owned pool
+        self.n_workers = None
+
+        # corners from parallel searches closer than this are merged
+        self.merge_radius = 1
+
+        # frame tracking, pixels whose gray level moves more than this are rescored
+        self.motion_threshold = 1.0
+
         # grid params
         self.grid_size = 30
         self.min_corner_score = 0.1
 
+        # pyramid params, level k is downscaled by pyramid_scale**k
+        self.pyramid_levels = 2
+        self.pyramid_scale = 2
+        self.pyramid_keep = 4 # coarse candidates kept per top_n corner
+        self.pyramid_slack = 0.5 # min_corner_score multiplier on coarse levels
+
+        # instrumentation, None for off, True or a SearchStats to record counters & stage times
+        self.stats = None
+
+        # search order, 'fifo' or 'best' (strongest score & deepest mode first)
+        # and an optional cap on new score evaluations per search
+        self.search_order = 'fifo'
+        self.eval_budget = None
+
         self.scored = None
-        self.scored_partial = None
         self.point_info = None
         self.basins = None
         self.corners = None
+        self.workspace = None
+        self.gather = None
 
         self.set_params(**kwargs)
 
 
     def set_params(self, self_correct=True, **kwargs):
+        if self.__dict__.get('owns_pool') and ('pool' in kwargs or 'n_workers' in kwargs):
+            self.close()
         self.__dict__.update(kwargs)
+        if self.stats is True:
+            self.stats = SearchStats()
+        if self.backend == 'numba' and numba is None:
+            warnings.warn('numba is not installed, falling back to the numpy backend')
+            self.backend = 'numpy'
+
         self.beam_diameter = 1 + self.beam_length * 2
         self.baked_angles = np.linspace(0, 2*pi, self.angle_count, endpoint=False)
         self.beam(self_correct)
 
+        if self.sharpened_key is not None and self.sharpened_key != self.bake_key():
+            self.bake()
+
 
-    def init(self, image):
+    def get_pool(self, processes=None):
+        # processes asks for a pool of that size, an owned pool of another size is replaced
+        if processes is not None and self.owns_pool and self.pool is not None \
+                and self.pool_size != processes:
+            self.close()
+        if self.pool is None:
+            self.pool_size = processes or self.n_workers or max(1, cpu_count() - 1)
+            self.pool = self.new_pool(self.pool_size)
+            self.owns_pool = True
+        return self.pool
+
+
+    @staticmethod
+    def new_pool(processes):
+        # start the tracker first so forked workers share it instead of each
+        # starting their own and unlinking our shared memory when they exit
+        resource_tracker.ensure_running()
+        locks = [Lock() for _ in range(SEARCH_LOCKS)]
+        return Pool(processes, _init_worker, (locks,))
+
+
+    def close(self):
+        # only shut down a pool this object created, callers manage their own
+        if self.owns_pool and self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+        self.owns_pool = False
+        self.pool_size = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['owns_pool'] = False
+        state['pool_size'] = None
+        state['stats'] = None # callbacks may not pickle and counts would not come back anyway
+        return state
+
+
+    def clone(self):
+        # same parameters and kernels, no image state and no pool
+        dc = DonutCorners.__new__(DonutCorners)
+        dc.__dict__.update(self.__getstate__())
+        for key in IMAGE_STATE:
+            dc.__dict__[key] = None
+        return dc
+
+
+    def float_type(self):
+        # working precision of the gradient, polar and score arrays
+        dtype = np.dtype(self.dtype)
+        return np.dtype('float32') if dtype.itemsize < 4 else dtype
+
+
+    def plane_type(self):
+        # storage precision of the baked sharpened planes, float32 unless asked for less
+        dtype = np.dtype(self.dtype)
+        return dtype if dtype.itemsize < 8 else np.dtype('float32')
+
+
+    def stage(self, name):
+        # times a block into stats when instrumentation is on
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.stage(name)
+
+
+    def init(self, image, keep_cache=False):
         if isinstance(image, str):
             self.src = io.imread(image)
         else:
             self.src = image
         
         self.dims = np.array(self.src.shape[:2], dtype=int)
-        self.scored_partial = np.empty(self.dims)
-        self.scored_partial[:] = np.NaN
-        self.point_info = {}
-        self.basins = np.zeros(self.dims, dtype=int)
+        self.scored = None
         self.corners = []
 
-        self.preprocess()
+        # same shaped images recycle the previous image's buffers
+        max_n = self.eval_method['max_n']
+        if self.point_info is not None and self.point_info.dims == tuple(self.dims) \
+                and self.point_info.max_n == max_n and self.point_info.float_type == self.float_type():
+            if not keep_cache:
+                self.point_info.reset()
+            self.point_info.baked_angles = self.baked_angles
+        else:
+            self.point_info = PointCache(self.dims, max_n, self.baked_angles, float_type=self.float_type())
+
+        if self.basins is not None and self.basins.shape == tuple(self.dims):
+            self.basins.fill(0)
+        else:
+            self.basins = np.zeros(self.dims, dtype=int)
+
+        with self.stage('preprocess'):
+            self.preprocess()
+
+
+    def get_workspace(self):
+        # gradient & padded polar buffers, reallocated only when the image shape or padding changes
+        l = int(self.beam_diameter/2 + 1)
+        dtype = self.float_type()
+        key = (self.src.shape, l, dtype)
+        if self.workspace is None or self.workspace['key'] != key:
+            h, w = self.src.shape[:2]
+            self.workspace = {'key': key,
+                              'bw': np.empty((h, w), dtype=dtype),
+                              'uv': np.empty((2, h, w), dtype=dtype),
+                              'scratch': np.empty((h, w), dtype=dtype),
+                              'polar': np.zeros((h + 2*l, w + 2*l, 2), dtype=dtype)}
+        return self.workspace
+
+
+    @staticmethod
+    def gradient(f, axis, out):
+        # np.gradient along one axis, written into out
+        f, out = np.moveaxis(f, axis, 0), np.moveaxis(out, axis, 0)
+        if f.shape[0] < 2:
+            raise ValueError("Shape of array too small to calculate a numerical gradient")
+        np.subtract(f[1:2], f[0:1], out=out[0:1], dtype=out.dtype)
+        np.subtract(f[-1:], f[-2:-1], out=out[-1:], dtype=out.dtype)
+        np.subtract(f[2:], f[:-2], out=out[1:-1], dtype=out.dtype)
+        out[1:-1] /= 2.
+        return out
 
 
     def preprocess(self):
+        ws = self.get_workspace()
         if len(self.src.shape) == 3:
-            self.bw = np.mean(self.src, axis=-1)
+            self.bw = np.mean(self.src, axis=-1, out=ws['bw'])
         else:
             self.bw = self.src
         l = int(self.beam_diameter/2 + 1)
 
-        self.uv = np.gradient(self.bw)
+        self.uv = ws['uv']
+        self.gradient(self.bw, 0, self.uv[0])
+        self.gradient(self.bw, 1, self.uv[1])
         x, y = self.uv[0], self.uv[1]
-        self.polar = np.stack((np.sqrt(x**2 + y**2), np.arctan2(y, x)))
-        self.polar = np.pad(self.polar, ((l,l),(l,l),(0,0)),mode='constant', constant_values=0)
 
+        # the padding stays zero, only the inside is rewritten
+        self.polar = ws['polar']
+        inner = self.polar[l:-l, l:-l]
+        np.arctan2(y, x, out=inner[...,0])
+        np.multiply(x, x, out=inner[...,1])
+        inner[...,1] += np.multiply(y, y, out=ws['scratch'])
+        np.sqrt(inner[...,1], out=inner[...,1])
+
+        self.sharpened, self.sharpened_key = None, None
+        if self.bake_sharpened:
+            with self.stage('bake'):
+                self.bake()
+
+
+    def bake_key(self):
+        return (self.angle_count, self.plane_count, self.sharpen_power)
+
+
+    def bake(self, region=None):
+        # one sharpened plane per stored kernel, dropped to the lazy path if too big
+        # theta and theta + pi sharpen identically, so halved banks need only half the planes
+        angles = self.baked_angles[:self.plane_count]
+        if region is not None:
+            # rebake only a (rows, cols) slice of the padded planes
+            polar = self.polar[region]
+            for i, angle in enumerate(angles):
+                self.sharpened[i][region] = self.sharpen(polar[...,0], angle, self.sharpen_power) * polar[...,1]
+            return
+
+        self.sharpened, self.sharpened_key = None, None
+        plane_type = self.plane_type()
+        if self.plane_count * self.polar[...,0].size * plane_type.itemsize > self.bake_max_bytes:
+            return
+
+        ws = self.get_workspace()
+        shape = (self.plane_count,) + self.polar.shape[:2]
+        if ws.get('sharpened') is None or ws['sharpened'].shape != shape \
+                or ws['sharpened'].dtype != plane_type:
+            ws['sharpened'] = np.empty(shape, dtype=plane_type)
+            ws['plane'] = np.empty(self.polar.shape[:2], dtype=self.polar.dtype)
+
+        # same steps as sharpen, done in place in a working precision scratch plane
+        plane = ws['plane']
+        for i, angle in enumerate(angles):
+            np.subtract(self.polar[...,0], angle, out=plane)
+            np.mod(plane, pi, out=plane)
+            plane -= pi/2
+            np.abs(plane, out=plane)
+            plane *= -self.sharpen_power
+            np.exp(plane, out=plane)
+            plane *= self.polar[...,1]
+            ws['sharpened'][i] = plane
+        self.sharpened = ws['sharpened']
+        self.sharpened_key = self.bake_key()
+
+
+    def update_planes(self, y0, y1, x0, x1):
+        # recompute gray, gradient, polar and baked planes after src changed inside the rect
+        h, w = self.dims
+        l = int(self.beam_diameter/2 + 1)
+        y0, y1, x0, x1 = max(y0, 0), min(y1, h), max(x0, 0), min(x1, w)
+        if y0 >= y1 or x0 >= x1:
+            return
 
-    def fit(self, X, y):
+        if len(self.src.shape) == 3:
+            self.bw[y0:y1, x0:x1] = np.mean(self.src[y0:y1, x0:x1], axis=-1)
+        else:
+            self.bw = self.src
+
+        # the gradient changes one pixel further out and needs one more pixel of context
+        g0, g1, h0, h1 = max(y0 - 1, 0), min(y1 + 1, h), max(x0 - 1, 0), min(x1 + 1, w)
+        c0, c1, d0, d1 = max(g0 - 1, 0), min(g1 + 1, h), max(h0 - 1, 0), min(h1 + 1, w)
+        block = self.bw[c0:c1, d0:d1]
+        uv = np.empty((2,) + block.shape, dtype=self.uv.dtype)
+        self.gradient(block, 0, uv[0])
+        self.gradient(block, 1, uv[1])
+        self.uv[:, g0:g1, h0:h1] = uv[:, g0 - c0 : g1 - c0, h0 - d0 : h1 - d0]
+
+        x, y = self.uv[0, g0:g1, h0:h1], self.uv[1, g0:g1, h0:h1]
+        region = (slice(l + g0, l + g1), slice(l + h0, l + h1))
+        self.polar[region + (0,)] = np.arctan2(y, x)
+        self.polar[region + (1,)] = np.sqrt(x**2 + y**2)
+
+        if self.sharpened is not None:
+            self.bake(region)
+
+
+    def update(self, image, dirty_rects, top_n=10, **kwargs):
+        # take a new version of the image that only changed inside dirty_rects (y0, y1, x0, x1),
+        # rescore and search again only where those changes reach
+        if np.shape(image)[:2] != tuple(self.dims):
+            raise ValueError('update needs an image of the same shape, use init instead')
+        self.src = image
+
+        for rect in dirty_rects:
+            self.update_planes(*rect)
+
+        h, w = self.dims
+        pad = int(self.beam_diameter) + 1
+        affected = np.zeros(self.dims, dtype=bool)
+        for y0, y1, x0, x1 in dirty_rects:
+            y0, y1, x0, x1 = max(y0 - pad, 0), min(y1 + pad, h), max(x0 - pad, 0), min(x1 + pad, w)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            affected[y0:y1, x0:x1] = True
+            if self.scored is not None:
+                self.scored[y0:y1, x0:x1] = self.select_beams(self.beam_means(y0, y1, x0, x1))[0]
+
+        self.point_info.invalidate(affected)
+        self.corners = [c for c in self.corners if not affected[tuple(c[1])]]
+        # walks from seeds up to a long ray away can climb into the changed area, search from them too
+        reach = ndimage.maximum_filter(affected, size=4 * int(self.beam_length) + 1)
+        seeds = [p for p in self.grid_points() if reach[tuple(p)]]
+        return self.find_corners_grid(top_n=top_n, seeds=seeds, **kwargs)
+
+
+    def fit(self, X, y=None, img_shape=None):
+        self.fit_transform(X, y, img_shape)
         return self
+
+
+    def fit_transform(self, X, y=None, img_shape=None, engineered_only=False):
+        self.check_img_shape(img_shape)
+
+        features = self.parallel_features(X)
+        self.fill_values = np.nanmean(features, axis=0)
+        self.pixel_fill_values = np.nanmean(X, axis=0)
+
+        return self.fill(X, features, engineered_only)
     
 
-    def transform(self, img_list, img_shape=None, engineered_only=False):
+    def transform(self, img_list, img_shape=None, engineered_only=False, n_jobs=None, chunk_size=None):
+        self.check_img_shape(img_shape)
+
+        features = self.parallel_features(img_list, n_jobs, chunk_size)
+
+        if self.fill_values is not None:
+            return self.fill(img_list, features, engineered_only)
+
+        # not fitted, fall back to the means of this batch
+        if self.engineered_only or engineered_only:
+            return self.impute(features, np.nanmean(features, axis=0))
+
+        with_features = np.hstack((img_list, features))
+        return self.impute(with_features, np.nanmean(with_features, axis=0))
+
+
+    def fill(self, img_list, features, engineered_only=False):
+        # impute with the fitted values, only touching the missing entries
+        features = self.impute(features, self.fill_values)
+        if self.engineered_only or engineered_only:
+            return features
+
+        pixels = np.array(img_list, dtype=self.float_type())
+        return np.hstack((self.impute(pixels, self.pixel_fill_values), features))
+
+
+    def transform_batches(self, img_list, img_shape=None, engineered_only=False,
+                          batch_size=None, fill_values=None, n_jobs=None):
+        # yields transformed blocks of batch_size images, never holding the full matrix
+        # without fill_values, the engineered features are kept for a second imputation pass
+        # pixels are imputed with the fitted pixel means, or the running means of img_list
+        self.check_img_shape(img_shape)
+        batch_size = batch_size or self.batch_size
+        starts = range(0, len(img_list), batch_size)
+        with_pixels = not (self.engineered_only or engineered_only)
+
+        if fill_values is None:
+            fill_values = self.fill_values
+        pixel_fill_values = self.pixel_fill_values
+
+        blocks = None
+        if fill_values is None:
+            imputer = RunningMean(self.feature_width())
+            blocks = []
+            for i in starts:
+                blocks.append(self.parallel_features(img_list[i:i + batch_size], n_jobs))
+                imputer.update(blocks[-1])
+            fill_values = imputer.means
+
+        if with_pixels and pixel_fill_values is None:
+            imputer = RunningMean(np.shape(img_list[0])[-1])
+            for i in starts:
+                imputer.update(np.array(img_list[i:i + batch_size], dtype=self.float_type()))
+            pixel_fill_values = imputer.means
+
+        for k, i in enumerate(starts):
+            if blocks is not None:
+                block, blocks[k] = blocks[k], None
+            else:
+                block = self.parallel_features(img_list[i:i + batch_size], n_jobs)
+            block = self.impute(block, fill_values)
+
+            if with_pixels:
+                pixels = np.array(img_list[i:i + batch_size], dtype=self.float_type())
+                yield np.hstack((self.impute(pixels, pixel_fill_values), block))
+            else:
+                yield block
+
+
+    def check_img_shape(self, img_shape):
         if self.search_args["img_shape"] is None:
             if img_shape:
                 self.search_args["img_shape"] = img_shape
             else:
                 raise ValueError("I need an image shape!")
-        
-        w = img_list.shape[1]
-        with_features = np.empty((img_list.shape[0], w + self.search_args["top_n"] * 7))
-        with_features[:, :w] = img_list
-        with_features[:, w:] = np.nan
+
+
+    @staticmethod
+    def impute(features, fill_values):
+        inds = np.where(np.isnan(features))
+        features[inds] = np.take(fill_values, inds[1])
+        return features
+
+
+    def feature_width(self):
+        # score, point and max_n angles & strengths for each of the top_n corners
+        return self.search_args["top_n"] * (3 + 2 * self.eval_method['max_n'])
+
+
+    def corner_features(self, img_list):
+        with self.stage('transform'):
+            return self._corner_features(img_list)
+
+
+    def _corner_features(self, img_list):
+        features = np.empty((len(img_list), self.feature_width()), dtype=self.float_type())
+        features[:] = np.nan
 
         for i, img in enumerate(img_list):
             self.init(img.reshape(self.search_args["img_shape"]))
             top = self.find_corners_grid(**self.search_args)
             if len(top) != 0:
                 top = np.hstack([np.hstack(((c[0],), (c[1]), c[2][1], c[2][2])).flatten() for c in top])
-                with_features[i,w:w + len(top)] = top
+                features[i, :len(top)] = top
             #print(f'{i/img_list.shape[0]:.2%}', end='\r')
 
-        means = np.nanmean(with_features, axis=0)
-        inds = np.where(np.isnan(with_features))
-        with_features[inds] = np.take(means, inds[1])
+        return features
+
+
+    def parallel_features(self, img_list, n_jobs=None, chunk_size=None):
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
+        if n_jobs is None or n_jobs == 1 or len(img_list) <= 1:
+            return self.corner_features(img_list)
+
+        if n_jobs < 0:
+            n_jobs = cpu_count()
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(img_list) // (4 * n_jobs)))
+        chunks = [img_list[i:i + chunk_size] for i in range(0, len(img_list), chunk_size)]
+
+        # every chunk gets its own copy so workers never share image state
+        tasks = [(self.clone(), chunk) for chunk in chunks]
+        if self.prefer == 'threads':
+            with ThreadPoolExecutor(n_jobs) as ex:
+                out = list(ex.map(_transform_chunk, tasks))
+        elif self.pool is not None and not self.owns_pool:
+            # a caller's pool or executor is used as given, whatever its size
+            out = list(self.pool.map(_transform_chunk, tasks))
+        else:
+            out = self.get_pool(n_jobs).map(_transform_chunk, tasks)
 
-        if self.engineered_only or engineered_only:
-            return with_features[:, w:]
-        
-        return with_features
+        return np.concatenate(out)
 
 
     def beam(self, self_correct=True):
-        r, d, ir = self.beam_length, self.beam_diameter, self.beam_start
-        w, spr, count = self.beam_width, self.fork_spread, self.angle_count
+        try:
+            bank = kernel_bank(self.angle_count, self.beam_width, self.fork_spread,
+                               self.beam_length, self.beam_start, self.angle_symmetry)
+        except ValueError:
+            if self_correct:
+                self.beam_width += 0.2
+                self.beam_length += 0.5 # this should fix it most of the time
+                self.beam_diameter = 1 + self.beam_length * 2
+                self.beam()
+                return
+            raise
 
-        di = int(d)
-        ind = np.array(list(np.ndindex((di,di)))).reshape((di,di,2))
-        delta = ind - d//2
+        self.__dict__.update(bank)
+        self.gather = None
 
-        beam_angles = np.linspace(0,2*pi, count, endpoint=False)
-        
-        beam_uvs = np.stack((-np.sin(beam_angles), np.cos(beam_angles)), axis=-1)
-        beam_perps = np.matmul(beam_uvs, DonutCorners.rot90)
 
-        len_on_line = np.array([delta.dot(uv) for uv in beam_uvs])
-        dist_to_line = np.array([delta.dot(perp) for perp in beam_perps])
-        
-        # make the prongs
-        spiral = np.maximum(w / 2 - np.abs(dist_to_line), 0)
+    def set_kernels(self, spiral):
+        self.__dict__.update(kernel_tables(spiral, self.plane_count))
+        self.gather = None
 
-        # clip to length & side
-        spiral[(len_on_line < ir) | (len_on_line > r)] = 0
 
-        # normalize
-        spiral = spiral / np.sum(spiral, axis=(1,2))[:, None, None]
+    def kernel(self, angle_id):
+        return self.spiral[angle_id]
 
-        # error checking
-        if np.any(np.isnan(spiral)):
-            if self_correct:
-                self.beam_width += 0.2
-                self.beam_length += 0.5 # this should fix it most of the time
-                self.beam()
-                return
-            raise ValueError('invalid beam values, getting nans in kernel')
 
-        # store
-        self.spiral = spiral.astype('float32')
-        self.spiral_mask = spiral != 0
-        self.weights = [self.spiral[i,...][self.spiral_mask[i,...]] for i in range(count)]
-        self.beam_index = np.argwhere(self.spiral_mask)[...,0]
-        self.beam_jumps = np.argwhere(self.beam_index[1:] != self.beam_index[:-1]).flatten() + 1
+    def kernels(self):
+        return self.spiral
+
+
+    def gather_tables(self):
+        # beam pixel offsets into the flattened plane score_point reads from and reusable
+        # per point buffers, rebuilt only when the kernels or the plane shape change
+        plane = self.sharpened if self.sharpened is not None else self.polar
+        key = (plane.shape, plane.dtype)
+        if self.gather is None or self.gather['key'] != key:
+            a, dy, dx = self.beam_offsets.T
+            if self.sharpened is not None:
+                _, hp, wp = plane.shape
+                offsets, stride = self.beam_planes * (hp * wp) + dy * wp + dx, 1
+            else:
+                hp, wp, _ = plane.shape
+                offsets, stride = (dy * wp + dx) * 2, 2 # angle channel, magnitude is one further
+            k = len(a)
+            self.gather = {'key': key, 'width': wp, 'stride': stride,
+                           'offsets': offsets.astype(np.intp),
+                           'angles': self.baked_angles.astype(self.float_type())[a],
+                           'idx': np.empty(k, dtype=np.intp),
+                           'taken': np.empty(k, dtype=plane.dtype),
+                           'mag': np.empty(k, dtype=plane.dtype),
+                           'vals': np.empty(k, dtype=self.float_type())}
+        return self.gather
 
 
     # scoring methods
@@ -164,20 +1053,36 @@ class DonutCorners():
         if inform:
             tp = tuple(point)
             if tp in self.point_info:
+                if self.stats is not None:
+                    self.stats.hits += 1
                 return self.point_info[tp][0], self.point_info[tp], True
 
-            info = self.score_point(point)
+            if self.stats is not None:
+                self.stats.misses += 1
+                t0 = time.perf_counter()
+                info = self.score_point(point)
+                self.stats.add_time('score_point', time.perf_counter() - t0)
+            else:
+                info = self.score_point(point)
             self.point_info[tp] = info
-            self.scored_partial[point[0], point[1]] = info[0]
             return info[0], info, False
 
         if self.scored is not None:
             return self.scored[point[0],point[1]]
         
-        if np.isnan(self.scored_partial[point[0],point[1]]):
-            self.scored_partial[point[0],point[1]] = self.score_point(point)[0]
+        tp = tuple(point)
+        if tp not in self.point_info:
+            self.point_info[tp] = self.score_point(point)
         
-        return self.scored_partial[point[0],point[1]]
+        return self.point_info[tp][0]
+
+
+    @property
+    def scored_partial(self):
+        # scores of every point searched so far, nan elsewhere
+        if self.point_info is None:
+            return None
+        return self.point_info.scores()
 
 
     @staticmethod
@@ -186,14 +1091,34 @@ class DonutCorners():
         return np.exp(-power_mult*angle_delta)
 
     def score_point(self, point):
-        di = int(self.beam_diameter)
-        region = self.polar[point[0] : point[0] + di,
-                            point[1] : point[1] + di, :]
-        
-        interest = [region[beam] for beam in self.spiral_mask]
-        sharpened = [self.sharpen(beam[:,0], angle) * beam[:,1]\
-            for angle, beam in zip(self.baked_angles, interest)]
-        means = np.array([np.abs(np.mean(w * i)) for w, i in zip(self.weights, sharpened)])
+        if self.backend == 'numba':
+            return self.score_points_numba(np.array([point]))[0]
+
+        # gather every beam pixel from the flat plane into preallocated buffers
+        g = self.gather_tables()
+        idx = np.add(g['offsets'], (point[0] * g['width'] + point[1]) * g['stride'], out=g['idx'])
+        vals = g['vals']
+
+        if self.sharpened is not None:
+            np.multiply(np.take(self.sharpened.reshape(-1), idx, out=g['taken'], mode='clip'),
+                        self.beam_weights, out=vals, dtype=vals.dtype)
+
+        else:
+            flat = self.polar.reshape(-1)
+            np.take(flat, idx, out=vals, mode='clip')
+            idx += 1
+            mag = np.take(flat, idx, out=g['mag'], mode='clip')
+
+            # sharpen in place
+            vals -= g['angles']
+            np.mod(vals, pi, out=vals)
+            vals -= pi/2
+            np.abs(vals, out=vals)
+            vals *= -self.sharpen_power
+            np.exp(vals, out=vals)
+            vals *= mag
+            vals *= self.beam_weights
+        means = np.abs(self.beam_sums(vals) / self.beam_counts)
 
         w=self.eval_method['elimination_width']
         no_doubles = self.eval_method['elim_double_ends']
@@ -208,6 +1133,68 @@ class DonutCorners():
         return np.mean(beam_strengths), angles, beam_strengths, beam_ids
     
 
+    def score_points(self, points):
+        # score_point for an (N, 2) array of points in one vectorized pass
+        # returns scores (N,) and angles, strengths & ids (N, max_n)
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        if self.backend == 'numba':
+            ids, strengths = self.numba_beams(points)
+            return np.mean(strengths, axis=1), self.baked_angles[ids], strengths, ids
+
+        g = self.gather_tables()
+        chunk = max(1, DENSE_BAND_BYTES // (len(self.beam_index) * 8 * 4))
+        means = np.empty((len(points), self.angle_count), dtype=self.float_type())
+
+        for c in range(0, len(points), chunk):
+            part = points[c : c + chunk]
+            idx = ((part[:, 0] * g['width'] + part[:, 1]) * g['stride'])[:, None] + g['offsets']
+            if self.sharpened is not None:
+                vals = np.multiply(np.take(self.sharpened.reshape(-1), idx), self.beam_weights,
+                                   dtype=self.float_type())
+            else:
+                flat = self.polar.reshape(-1)
+                vals = self.sharpen(np.take(flat, idx), g['angles'], self.sharpen_power) \
+                    * np.take(flat, idx + 1) * self.beam_weights
+
+            means[c : c + chunk] = np.abs(self.beam_sums(vals) / self.beam_counts)
+
+        return self.select_beams(means)
+
+
+    def beam_sums(self, vals):
+        # per angle sums over the last axis of gathered beam pixels, one reduceat over the csr segments
+        # empty angles have no segment of their own, they are left at zero
+        sums = np.add.reduceat(vals, self.beam_starts, axis=-1)
+        if len(self.beam_empty):
+            full = np.zeros(sums.shape[:-1] + (len(self.beam_counts),), dtype=sums.dtype)
+            full[..., self.beam_filled] = sums
+            return full
+        return sums
+
+
+    def score_points_numba(self, points):
+        ids, strengths = self.numba_beams(points)
+        return [(np.mean(s), self.baked_angles[i], s, i) for i, s in zip(ids, strengths)]
+
+
+    def numba_beams(self, points):
+        points = np.asarray(points, dtype=np.int64)
+        w=self.eval_method['elimination_width']
+        no_doubles = self.eval_method['elim_double_ends']
+        max_n = self.eval_method['max_n']
+
+        # numba has no half floats, float16 planes are scored from polar instead
+        if self.sharpened is not None and self.sharpened.dtype.itemsize >= 4:
+            ids, strengths = _nb_score_points_baked(self.sharpened, points, self.beam_offsets,
+                self.beam_planes, self.beam_weights, self.beam_counts, w, no_doubles, max_n)
+        else:
+            ids, strengths = _nb_score_points_polar(self.polar, points, self.beam_offsets,
+                self.beam_weights, self.beam_counts, self.baked_angles, self.sharpen_power,
+                w, no_doubles, max_n)
+
+        return ids, strengths
+
+
     @staticmethod
     def get_max_idx(vals, w = 1, no_doubles = True, gradual = False):
         arg = np.argmax(vals)
@@ -230,16 +1217,223 @@ class DonutCorners():
         return [self.score_point([y,x])[0] for x in range(self.src.shape[1])]
 
 
-    def score_all(self, multithread = True):
-        
+    # dense scoring methods
+    def sharpened_plane(self, angle_id):
+        angle_id = angle_id % self.plane_count
+        if self.sharpened is not None:
+            return self.sharpened[angle_id]
+        angle = self.baked_angles[angle_id]
+        return self.sharpen(self.polar[...,0], angle, self.sharpen_power) * self.polar[...,1]
+
+
+    def beam_means(self, y0, y1, x0 = 0, x1 = None):
+        # mean beam response of every angle for every pixel in rows y0:y1, columns x0:x1
+        # same as the means in score_point, computed as correlations of the
+        # sharpened planes with the spiral kernels
+        if x1 is None:
+            x1 = self.dims[1]
+        di = int(self.beam_diameter)
+        h, w = y1 - y0, x1 - x0
+        means = np.empty((h, w, self.angle_count), dtype=self.float_type())
+
+        # opposite angles share a sharpened plane, each plane is built & transformed once
+        for i in range(self.plane_count):
+            region = self.sharpened_plane(i)[y0 : y1 + di - 1, x0 : x1 + di - 1]
+            angle_ids = range(i, self.angle_count, self.plane_count)
+            for j, out in zip(angle_ids, self.correlate_beams(region, angle_ids)):
+                means[..., j] = out / self.beam_counts[j]
+
+        return np.abs(means)
+
+
+    def conv_method(self, angle_id, shape):
+        if self.conv_backend != 'auto':
+            return self.conv_backend
+
+        # direct costs one pass over the output per kernel tap,
+        # fft costs roughly n*log2(n) over the padded region
+        di = int(self.beam_diameter)
+        n = (shape[0] + di - 1) * (shape[1] + di - 1)
+        if self.beam_counts[angle_id] * shape[0] * shape[1] > FFT_COST * n * np.log2(n):
+            return 'fft'
+        return 'direct'
+
+
+    def correlate_beam(self, region, angle_id):
+        # 'valid' correlation of a padded region with one spiral kernel
+        di = int(self.beam_diameter)
+        h, w = region.shape[0] - di + 1, region.shape[1] - di + 1
+        method = self.conv_method(angle_id, (h, w))
+        region = region.astype(self.float_type(), copy=False)
+
+        if method == 'direct':
+            out = np.zeros((h, w), dtype=self.float_type())
+            kernel = self.kernel(angle_id)
+            mask = kernel != 0
+            for (dy, dx), weight in zip(np.argwhere(mask), kernel[mask]):
+                out += weight * region[dy : dy + h, dx : dx + w]
+            return out
+
+        kernel = self.kernel(angle_id)[::-1, ::-1].astype(self.float_type())
+        if method == 'fft':
+            return signal.fftconvolve(region, kernel, mode='valid')
+        if method == 'oa':
+            return signal.oaconvolve(region, kernel, mode='valid')
+        raise ValueError(f'unknown conv_backend {method}')
+
+
+    def correlate_beams(self, region, angle_ids):
+        # correlate_beam for several kernels over the same region, fft ones share the region's transform
+        angle_ids = list(angle_ids)
+        if len(angle_ids) < 2 or any(self.conv_method(i, (region.shape[0] - int(self.beam_diameter) + 1,
+                region.shape[1] - int(self.beam_diameter) + 1)) != 'fft' for i in angle_ids):
+            return [self.correlate_beam(region, i) for i in angle_ids]
+
+        # circular convolution at the region size leaves the 'valid' part untouched
+        di = int(self.beam_diameter)
+        shape = [sp_fft.next_fast_len(n, True) for n in region.shape]
+        spectrum = sp_fft.rfft2(region.astype(self.float_type(), copy=False), shape)
+        out = []
+        for i in angle_ids:
+            kernel = self.kernel(i)[::-1, ::-1].astype(self.float_type())
+            full = sp_fft.irfft2(spectrum * sp_fft.rfft2(kernel, shape), shape)
+            out.append(full[di - 1 : region.shape[0], di - 1 : region.shape[1]])
+        return out
+
+
+    def select_beams(self, means):
+        # vectorized get_max_idx over the last axis of means
+        w=self.eval_method['elimination_width']
+        no_doubles = self.eval_method['elim_double_ends']
+
+        flat = means.reshape(-1, means.shape[-1])
+        maxs = [DonutCorners.get_max_idxs(flat, w=w, no_doubles=no_doubles)
+                for _ in range(self.eval_method['max_n'])]
+
+        beam_ids = np.stack([m[0] for m in maxs], axis=-1).reshape(means.shape[:-1] + (-1,))
+        beam_strengths = np.stack([m[1] for m in maxs], axis=-1).reshape(beam_ids.shape)
+        angles = self.baked_angles[beam_ids]
+
+        return np.mean(beam_strengths, axis=-1), angles, beam_strengths, beam_ids
+
+
+    @staticmethod
+    def get_max_idxs(vals, w = 1, no_doubles = True):
+        rows = np.arange(vals.shape[0])[:, None]
+        arg = np.argmax(vals, axis=1)
+        val = vals[rows[:,0], arg]
+        ind = (arg[:, None] + np.arange(-w, w + 1)) % vals.shape[1]
+        vals[rows, ind] = 0
+
+        if no_doubles:
+            vals[rows, (ind + vals.shape[1]//2) % vals.shape[1]] = 0
+
+        return [arg, val]
+
+
+    def score_band(self, bounds):
+        return self.select_beams(self.beam_means(*bounds))[0]
+
+
+    def bands(self):
+        # split the image into row bands that keep beam_means under DENSE_BAND_BYTES
+        per_row = self.dims[1] * self.angle_count * 8
+        rows = int(max(1, min(self.dims[0], DENSE_BAND_BYTES // per_row)))
+        return [(y, min(y + rows, self.dims[0])) for y in range(0, self.dims[0], rows)]
+
+
+    def tiles(self):
+        # square tiles that keep each worker's beam_means under DENSE_BAND_BYTES
+        side = int(max(1, (DENSE_BAND_BYTES / (self.angle_count * 8)) ** 0.5))
+        return [(y, min(y + side, self.dims[0]), x, min(x + side, self.dims[1]))
+                for y in range(0, self.dims[0], side) for x in range(0, self.dims[1], side)]
+
+
+    def score_shared(self):
+        # workers attach to the planes and kernels in shared memory and write
+        # their tiles straight into a shared score map
+        arrays = {'spiral': self.spiral, 'scored': np.zeros(self.dims, dtype=self.float_type())}
+        if self.sharpened is not None:
+            arrays['sharpened'] = self.sharpened
+        else:
+            arrays['polar'] = self.polar
+
+        params = {key: self.__dict__[key] for key in SHARED_KEYS}
+        blocks, specs = _shm_share(arrays)
+        try:
+            list(self.get_pool().map(_score_tile, [(params, specs, tile) for tile in self.tiles()]))
+            return np.ndarray(self.dims, dtype=self.float_type(), buffer=blocks['scored'].buf).copy()
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+
+    def score_tiled(self, source, out_prefix, tile = None):
+        # out-of-core dense scoring for images too big to hold. source is anything sliceable
+        # like an np.memmap, or a path to a .npy file. Tiles are read with a halo that covers
+        # the donut and gradient stencil, scores go to <out_prefix>_scores.npy and local maxima
+        # above min_corner_score are appended to <out_prefix>_corners.dat
+        if isinstance(source, str):
+            source = np.load(source, mmap_mode='r')
+        h, w = source.shape[:2]
+        tile = tile or int(max(1, (DENSE_BAND_BYTES / (self.angle_count * 8)) ** 0.5))
+        halo = int(self.beam_diameter/2 + 1) + 3
+        max_n = self.eval_method['max_n']
+        dtype = np.dtype([('score', 'f8'), ('point', 'i8', (2,)),
+                          ('angles', 'f8', (max_n,)), ('strengths', 'f8', (max_n,))])
+
+        scored = np.lib.format.open_memmap(out_prefix + '_scores.npy', mode='w+',
+                                           dtype=self.float_type(), shape=(h, w))
+        dc = self.clone()
+        with open(out_prefix + '_corners.dat', 'wb') as corner_file:
+            for y0 in range(0, h, tile):
+                for x0 in range(0, w, tile):
+                    y1, x1 = min(y0 + tile, h), min(x0 + tile, w)
+                    by, bx = max(y0 - halo, 0), max(x0 - halo, 0)
+                    dc.init(np.asarray(source[by : min(y1 + halo, h), bx : min(x1 + halo, w)]))
+
+                    # one extra pixel around the tile for the local maximum test
+                    sy, sx = max(y0 - 1, 0), max(x0 - 1, 0)
+                    sy1, sx1 = min(y1 + 1, h), min(x1 + 1, w)
+                    score, angles, strengths, _ = dc.select_beams(
+                        dc.beam_means(sy - by, sy1 - by, sx - bx, sx1 - bx))
+
+                    inside = (slice(y0 - sy, y1 - sy), slice(x0 - sx, x1 - sx))
+                    scored[y0:y1, x0:x1] = score[inside]
+
+                    peaks = (score == ndimage.maximum_filter(score, size=3)) & (score > self.min_corner_score)
+                    peaks[:y0 - sy], peaks[y1 - sy:], peaks[:, :x0 - sx], peaks[:, x1 - sx:] = False, False, False, False
+                    points = np.argwhere(peaks)
+                    records = np.empty(len(points), dtype=dtype)
+                    records['score'] = score[peaks]
+                    records['point'] = points + (sy, sx)
+                    records['angles'], records['strengths'] = angles[peaks], strengths[peaks]
+                    records.tofile(corner_file)
+
+        scored.flush()
+        n = os.path.getsize(out_prefix + '_corners.dat') // dtype.itemsize
+        if n == 0:
+            return scored, np.empty(0, dtype=dtype)
+        return scored, np.memmap(out_prefix + '_corners.dat', dtype=dtype, mode='r', shape=(n,))
+
+
+    def score_all(self, multithread = True, dense = False):
+        with self.stage('score_all'):
+            return self._score_all(multithread, dense)
+
+
+    def _score_all(self, multithread, dense):
         if multithread:
-            with Pool(cpu_count() - 1) as p:
-                out = p.map(self.score_row, range(self.src.shape[0]))
+            out = self.score_shared()
+
+        elif dense:
+            out = np.concatenate([self.score_band(b) for b in self.bands()])
         
         else:
             out = [self.score_row(y) for y in range(self.src.shape[0])]
         
-        out = np.array(out)
+        out = np.array(out, dtype=self.float_type())
         
         self.scored = out
         return out
@@ -250,24 +1444,45 @@ class DonutCorners():
 
 
     def out_of_bounds(self, point):
-        return not np.all((point >= 0) & (point < self.src.shape[:-1]))
+        return not np.all((point >= 0) & (point < self.dims))
         
 
     def search_rays(self, point, angles, dists, info):
-        best_v, best_p, best_i, best_info = info[0], point, -1, info
-        for angle in angles:
-            for new_i, dist in enumerate(dists):
-                new_p = point + np.round(dist*np.array((np.sin(angle),np.cos(angle)))).astype(int)
-                assert not np.all(new_p == point)
-                if self.out_of_bounds(new_p):
-                    continue
-                new_v, new_info, exist = self.get_score(new_p, True)
-                assert new_info is not None
-                # if exist:
-                #     # this point has already been part of a search, stop searching neighbors
-                #     return
-                if new_v > best_v:
-                    best_v, best_p, best_i, best_info = new_v, new_p, new_i, new_info
+        # every ray point of this step that isn't cached yet is scored in one score_points call
+        dirs = np.stack((np.sin(angles), np.cos(angles)), axis=-1)
+        steps = np.round(np.array(dists)[None,:,None] * dirs[:,None,:]).astype(int)
+        assert not np.any(np.all(steps == 0, axis=-1))
+
+        points = (point + steps).reshape(-1, 2)
+        dist_ids = np.tile(np.arange(len(dists)), len(angles))
+        inside = np.all((points >= 0) & (points < self.dims), axis=1)
+        points, dist_ids = points[inside], dist_ids[inside]
+
+        keys = [tuple(p) for p in points]
+        missing = list(dict.fromkeys(tp for tp in keys if tp not in self.point_info))
+        if self.stats is not None:
+            self.stats.misses += len(missing)
+            self.stats.hits += len(keys) - len(missing)
+        if missing:
+            if self.stats is not None:
+                t0 = time.perf_counter()
+                scores, angles_, strengths, ids = self.score_points(missing)
+                self.stats.add_time('score_point', time.perf_counter() - t0)
+            else:
+                scores, angles_, strengths, ids = self.score_points(missing)
+            if isinstance(self.point_info, PointCache):
+                self.point_info.set_many(missing, scores, strengths, ids)
+            else:
+                for tp, v, a, st, i in zip(missing, scores, angles_, strengths, ids):
+                    self.point_info[tp] = (v, a, st, i)
+
+        best_p, best_i, best_info = point, -1, info
+        if keys:
+            vals = np.array([self.point_info[tp][0] for tp in keys])
+            k = np.argmax(vals)
+            if vals[k] > info[0]:
+                best_p, best_i, best_info = points[k], dist_ids[k], self.point_info[keys[k]]
+
         if best_i == -1:
             mode = -1
         elif best_i == 0 or best_i == len(angles) - 1:
@@ -275,48 +1490,242 @@ class DonutCorners():
         else:
             mode = 1
         return (mode, best_p, best_info)
-    
-    
-    def find_corners_grid(self, multithread = False, top_n=10, single_point = None, **kwargs):
-        #from queue import Queue
-        #q = Queue()
-        q = deque()
+
+
+    def pyramid_level(self, level):
+        # copy of this detector on the image downscaled by pyramid_scale**level
+        # with the beam scaled down to match
+        f = self.pyramid_scale ** level
+        dc = self.clone()
+        dc.set_params(beam_length = self.beam_length / f,
+                      beam_start = self.beam_start / f,
+                      beam_width = max(1, self.beam_width / f),
+                      grid_size = max(1, self.grid_size // f))
+        factors = (f, f) + (1,) * (self.src.ndim - 2)
+        dc.init(downscale_local_mean(self.src.astype(float), factors))
+        return dc
+
+
+    def refine(self, points, radius):
+        # move each point to the best scoring pixel within radius
+        out = []
+        for point in points:
+            y0, x0 = np.maximum(point - radius, 0)
+            y1, x1 = np.minimum(point + radius + 1, self.dims)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            window = self.select_beams(self.beam_means(y0, y1, x0, x1))[0]
+            out.append(np.unravel_index(np.argmax(window), window.shape) + np.array((y0, x0)))
+        return np.unique(np.array(out, dtype=int).reshape(-1, 2), axis=0)
+
+
+    def find_corners_pyramid(self, top_n=10, levels=None, **kwargs):
+        levels = self.pyramid_levels if levels is None else levels
+        s = self.pyramid_scale
+
+        # score the whole coarsest level, keep its strongest local maxima
+        coarse = self.pyramid_level(levels - 1)
+        scored = coarse.score_all(False, dense=True)
+        peaks = (scored == ndimage.maximum_filter(scored, size=3)) & \
+                (scored > self.min_corner_score * self.pyramid_slack)
+        candidates = np.argwhere(peaks)
+        candidates = candidates[np.argsort(scored[peaks])[::-1][:top_n * self.pyramid_keep]]
+
+        # walk the candidates down to native resolution
+        for level in range(levels - 2, -1, -1):
+            dc = self if level == 0 else self.pyramid_level(level)
+            candidates = dc.refine(candidates * s + s // 2, s)
+
+        # candidates already sit next to their maxima, only climb locally
+        # kwargs go to that final search, e.g. eval_budget, tracked or search_order
+        return self.find_corners_grid(top_n=top_n, seeds=candidates, local=True, **kwargs)
+
+
+    def grid_points(self):
+        grid = np.mgrid[self.grid_size//2:self.dims[0]:self.grid_size,
+                self.grid_size//2:self.dims[1]:self.grid_size]
+        return np.swapaxes(grid, 0,2).reshape(-1,2)
+
+
+    def find_corners_parallel(self, top_n=10, seeds=None, parts=None, tracked=None, eval_budget=None, **kwargs):
+        # split the seeds into row strips, search each strip in a worker with a shared
+        # score cache, then merge near-identical corners found by more than one worker
+        # tracked corners are dealt out over the strips, and eval_budget is split evenly
+        # between them, so the whole search still makes at most about eval_budget new evaluations
+        if seeds is None:
+            seeds = self.grid_points()
+        seeds = np.array(seeds, dtype=int).reshape(-1, 2)
+        seeds = seeds[np.lexsort((seeds[:,1], seeds[:,0]))]
+
+        max_n = self.eval_method['max_n']
+        shape = tuple(self.dims)
+        score, strengths, ids, valid = self.point_info.arrays()
+        arrays = {'score': score, 'strengths': strengths, 'ids': ids,
+                  'state': np.where(valid, SharedPointInfo.DONE, 0).astype(np.int32)}
+        if self.sharpened is not None:
+            arrays['sharpened'] = self.sharpened
+        else:
+            arrays['polar'] = self.polar
+
+        pool = self.get_pool()
+        parts = parts or 2 * (self.n_workers or max(1, cpu_count() - 1))
+        blocks, specs = _shm_share(arrays)
+        manager = None
+        try:
+            # pools we did not create have no lock stripes of their own
+            locks = None
+            if not self.owns_pool:
+                manager = Manager()
+                locks = [manager.Lock() for _ in range(SEARCH_LOCKS)]
+
+            dc = self.clone()
+            strips = [part for part in np.array_split(seeds, parts) if len(part)]
+            tracked = list(tracked or [])
+            eval_budget = self.eval_budget if eval_budget is None else eval_budget
+            tasks = []
+            for i, part in enumerate(strips):
+                budget = None if eval_budget is None else \
+                    eval_budget // len(strips) + (i < eval_budget % len(strips))
+                task_kwargs = dict(kwargs, tracked=tracked[i::len(strips)], eval_budget=budget)
+                tasks.append((dc, specs, part, i + 1, locks, task_kwargs))
+            found = [c for corners in pool.map(_search_seeds, tasks) for c in corners]
+
+            shared = {name: np.ndarray(spec[1], dtype=spec[2], buffer=blocks[name].buf)
+                      for name, spec in specs.items()}
+            done = shared['state'] == SharedPointInfo.DONE
+            self.point_info.set_many(np.argwhere(done), shared['score'][done],
+                                     shared['strengths'][done], shared['ids'][done])
+        finally:
+            if manager is not None:
+                manager.shutdown()
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+        self.corners.extend(self.merge_corners(found, self.merge_radius))
+        strengths = [a[0] for a in self.corners]
+        top = np.argsort(strengths)[-1:-top_n-1:-1] # make strongest first
+        return [self.corners[i] for i in top]
+
+
+    @staticmethod
+    def merge_corners(corners, radius=1):
+        # strongest first, dropping corners within radius of a stronger one
+        kept = []
+        for corner in sorted(corners, key=lambda c: -c[0]):
+            if all(np.max(np.abs(corner[1] - k[1])) > radius for k in kept):
+                kept.append(corner)
+        return kept
+
+
+    def dirty_mask(self, prev_bw):
+        # pixels whose score can differ from the previous frame: changed gray levels
+        # grown by the donut radius plus the gradient stencil
+        changed = np.abs(self.bw - prev_bw) > self.motion_threshold
+        size = 2 * (int(self.beam_length) + 3) + 1
+        return ndimage.maximum_filter(changed, size=size)
+
+
+    def track(self, frames, top_n=10, **kwargs):
+        # yields the corners of each frame, searching from the last frame's corners
+        # and rescoring only where the frame changed
+        prev_bw, tracks = None, []
+        for frame in frames:
+            if prev_bw is None or prev_bw.shape != np.shape(frame)[:2]:
+                self.init(frame)
+                corners = self.find_corners_grid(top_n=top_n, **kwargs)
+            else:
+                self.init(frame, keep_cache=True)
+                dirty = self.dirty_mask(prev_bw)
+                self.point_info.invalidate(dirty)
+
+                # grid seeds only in changed areas with no tracked corner nearby
+                seeds = [p for p in self.grid_points() if dirty[tuple(p)] and not any(
+                         np.max(np.abs(p - c[1])) <= self.grid_size // 2 for c in tracks)]
+                corners = self.find_corners_grid(top_n=top_n, seeds=seeds, tracked=tracks, **kwargs)
+
+            tracks = self.merge_corners(self.corners, self.merge_radius)
+            prev_bw = np.array(self.bw, dtype=float)
+            yield corners
+
+
+    def find_corners_grid(self, multithread = False, top_n=10, single_point = None, seeds = None, local = False,
+                          search_order = None, eval_budget = None, tracked = None, **kwargs):
+        if multithread and single_point is None:
+            return self.find_corners_parallel(top_n, seeds, local=local, search_order=search_order,
+                                              eval_budget=eval_budget, tracked=tracked, **kwargs)
+
+        search_order = search_order or self.search_order
+        eval_budget = self.eval_budget if eval_budget is None else eval_budget
+        q = deque() if search_order == 'fifo' else []
+        tiebreak = count()
         bl = self.beam_length
+        evals_start = len(self.point_info)
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+
+        def push(data):
+            if search_order == 'fifo':
+                q.append(data)
+            else:
+                # unscored seeds go first so the strongest ones are followed first
+                score = np.inf if data[2] is None else data[2][0]
+                heapq.heappush(q, (-score, -data[0], next(tiebreak), data))
+
+        def pop():
+            if search_order == 'fifo':
+                return q.popleft()
+            return heapq.heappop(q)[-1]
 
         std_rays = np.swapaxes(np.mgrid[-1:2,-1:2], 0,2)
         std_rays = np.delete(std_rays, (8,9)).reshape(-1,2)
         
         if single_point is not None:
-            q.append((1, single_point, None))
+            push((1, single_point, None))
+
+        elif seeds is not None:
+            for point in seeds:
+                push((1, point, None))
 
         else:
-            grid = np.mgrid[self.grid_size//2:self.dims[0]:self.grid_size,
-                    self.grid_size//2:self.dims[1]:self.grid_size]
-            # grid_size = grid.shape[:2]
-            grid_points = np.swapaxes(grid, 0,2).reshape(-1,2)
+            for point in self.grid_points():
+                push((1, point, None))
 
-            for point in grid_points:
-                q.append((1, point, None))
+        # corners from a previous frame start at the short rays along their old beams
+        for _, point, old_info in tracked or []:
+            val, info, _ = self.get_score(point, True)
+            push((3, point, (val,) + tuple(old_info[1:])))
         
         brute_angles = np.math.pi * np.arange(8) / 4
         mode_points_tried = set()
+        # corners kept from an earlier search, walks reaching them again don't add them twice
+        corner_points = {tuple(c[1]) for c in self.corners}
 
         def add(data):
             tp = (data[0],) + tuple(data[1])
             if tp not in mode_points_tried:
                 mode_points_tried.add(tp)
-                q.append(data)
+                push(data)
 
         #print(" x".ljust(8)," y".ljust(8), "queue".rjust(8))
 
-        while True:
-            mode, point, info = q.popleft()
+        while q:
+            if eval_budget is not None and len(self.point_info) - evals_start >= eval_budget:
+                break # anytime, return the best corners found so far
+
+            mode, point, info = pop()
+            step_mode = mode # mode is advanced below, stats are credited to the one processed
             # info = score, angles, beam_strengths, beam_ids
+            if stats is not None:
+                stats.queue_max = max(stats.queue_max, len(q) + 1)
+                stats.steps[step_mode] += 1
+                evals_before = len(self.point_info)
 
             if mode == 1: # initial grid point
                 val, info, _ = self.get_score(point, True)
                 if val > self.min_corner_score:
-                    add((2, point, info))
+                    add((3 if local else 2, point, info))
 
             else:
                 if mode == 2: # following rays long dist
@@ -340,10 +1749,13 @@ class DonutCorners():
                 mode_add, point2, info2 = self.search_rays(point, angles, dists, info)
 
                 if mode_add == -1 and mode == 4: # found a local max
-                    self.corners.append((info2[0], point2, info2))
+                    if tuple(point2) not in corner_points:
+                        corner_points.add(tuple(point2))
+                        self.corners.append((info2[0], point2, info2))
                     
                     info2 = (info2[0]*0.5,) + info2[1:] # don't disqualify points slightly weaker than this in edge following
-                    add((5, point2, info2))
+                    if not local:
+                        add((5, point2, info2))
 
                 elif mode == 5: # looking for potential other corners
                     if mode_add != -1: # found one
@@ -354,15 +1766,18 @@ class DonutCorners():
                     mode += abs(mode_add)
                     add((mode, point2, info2))
 
+            if stats is not None:
+                stats.evals[step_mode] += len(self.point_info) - evals_before
+
             #print(str(point[0]).ljust(8),str(point[1]).ljust(8), str(len(q)).rjust(8), end='\r')
-            if len(q) == 0:
-                break
 
             # if q.qsize() == 0:
             #     q.join()
             #     if q.qsize() == 0:
             #         break
 
+        if stats is not None:
+            stats.add_time('search', time.perf_counter() - t0)
 
         strengths = [a[0] for a in self.corners]
         top = np.argsort(strengths)[-1:-top_n-1:-1] # make strongest first
@@ -71,7 +71,7 @@ def paint_corners(img, dc: DonutCorners):
 
 
 def show_beam(dc: DonutCorners):
-    show_3d_kernel(dc.spiral)
+    show_3d_kernel(dc.kernels())
 
 
 def show_3d_kernel(arr, ret=False):
@@ -260,7 +260,7 @@ if __name__ == "__main__":
     img = img[100:200, 850:950]
     dc.init(img)
 
-    #show_3d_kernel(dc.spiral)
+    #show_3d_kernel(dc.kernels())
     #show_img_plotly(dc.src)
     #show_slope_polar(dc.polar)
     show_src_slopes(dc)